@@ -5,12 +5,28 @@ from flask_moment import Moment
 from flask_login import LoginManager
 from config import config
 from flask_mail import Mail
+from .last_seen import LastSeenTracker
+from .principals import PrincipalCache
+from .credentials import CredentialCache
+from .fragments import FragmentCache
+from .pages import PageCache
+from .broadcast import Broadcaster
+from .outbox import Outbox
+from .jobs import JobRunner
 
 bootstrap = Bootstrap()
 db = SQLAlchemy()
 mail = Mail()
 moment = Moment()
 login_manager = LoginManager()
+last_seen_tracker = LastSeenTracker()
+principal_cache = PrincipalCache()
+credential_cache = CredentialCache()
+fragment_cache = FragmentCache()
+page_cache = PageCache()
+broadcaster = Broadcaster()
+outbox = Outbox()
+job_runner = JobRunner()
 login_manager.login_view = 'auth.login'
 
 def create_app(config_name="default"):
@@ -26,6 +42,14 @@ def create_app(config_name="default"):
     mail.init_app(app)
     moment.init_app(app)
     login_manager.init_app(app)
+    last_seen_tracker.init_app(app)
+    principal_cache.init_app(app)
+    credential_cache.init_app(app)
+    fragment_cache.init_app(app)
+    page_cache.init_app(app)
+    broadcaster.init_app(app)
+    outbox.init_app(app)
+    job_runner.init_app(app)
     app.logger.debug("Initialized all extensions.")
 
     from .main import main as main_blueprint
@@ -1,8 +1,10 @@
-from flask import g, jsonify
+from flask import g
 from flask_httpauth import HTTPBasicAuth
 from . import api
 from .errors import unauthorized, forbidden
+from .. import credential_cache, principal_cache
 from ..models import User
+from ..serialization import jsonify
 
 auth = HTTPBasicAuth()
 
@@ -14,12 +16,23 @@ def verify_password(email_or_token, password):
         g.current_user = User.verify_auth_token(email_or_token)
         g.token_used = True
         return g.current_user is not None
+    g.token_used = False
+    # Same credentials verified a moment ago? Then skip the slow hash
+    cached = credential_cache.lookup(email_or_token, password)
+    if cached is not None:
+        user_id, password_hash = cached
+        user = principal_cache.load_user(user_id)
+        if user is not None and user.password_hash == password_hash:
+            g.current_user = user
+            return True
     user = User.query.filter_by(email=email_or_token).first()
     if not user:
         return False
     g.current_user = user
-    g.token_used = False
-    return user.verify_password(password)
+    if not credential_cache.check_password(user.password_hash, password):
+        return False
+    credential_cache.remember(email_or_token, password, user)
+    return True
 
 
 @auth.error_handler
@@ -0,0 +1,98 @@
+from flask import current_app, g, request
+from . import api
+from .errors import bad_request
+from .. import db
+from ..exceptions import ValidationError
+from ..models import Comment, Composition, Permission, deferred_row_work
+from ..serialization import api_url, jsonify
+
+
+def failed(status, error, message):
+    return {'status': status, 'error': error, 'message': message}
+
+
+@api.route('/batch', methods=['POST'])
+def batch():
+    """
+    Create many compositions and comments in one request and one
+    transaction. The body looks like
+
+        {"compositions": [{"release_type": 0, "title": ..., "description": ...}],
+         "comments": [{"composition_id": 7, "body": ...}]}
+
+    and the response has one result per item, in the same order: status
+    201 and the new url, or the status, error and message the single-item
+    endpoints would have answered with. Invalid items don't stop the rest.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return bad_request('Expected an object with compositions and/or comments')
+    items = {name: payload.get(name) or [] for name in ('compositions', 'comments')}
+    if not all(isinstance(value, list) for value in items.values()):
+        return bad_request('compositions and comments must be lists')
+    limit = current_app.config['RAGTIME_BATCH_LIMIT']
+    if sum(len(value) for value in items.values()) > limit:
+        return bad_request(f'At most {limit} items per batch')
+
+    user = g.current_user
+    results = {name: [None] * len(value) for name, value in items.items()}
+    created = {'compositions': [], 'comments': []}
+
+    # Every composition commented on, in one query, before
+    # anything new is in the session for it to autoflush
+    ids = {item.get('composition_id') for item in items['comments']
+           if isinstance(item, dict) and isinstance(item.get('composition_id'), int)}
+    compositions = {c.id: c for c in Composition.query.filter(Composition.id.in_(ids))} \
+        if ids else {}
+
+    for i, item in enumerate(items['compositions']):
+        if not user.can(Permission.PUBLISH):
+            results['compositions'][i] = failed(403, 'forbidden', 'Insufficient permissions')
+            continue
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError('Expected an object')
+            composition = Composition.from_json(item)
+        except ValidationError as e:
+            results['compositions'][i] = failed(400, 'bad request', e.args[0])
+            continue
+        composition.artist = user
+        created['compositions'].append((i, composition))
+
+    for i, item in enumerate(items['comments']):
+        if not user.can(Permission.COMMENT):
+            results['comments'][i] = failed(403, 'forbidden', 'Insufficient permissions')
+            continue
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError('Expected an object')
+            comment = Comment.from_json(item)
+        except ValidationError as e:
+            results['comments'][i] = failed(400, 'bad request', e.args[0])
+            continue
+        composition_id = item.get('composition_id')
+        composition = compositions.get(composition_id) \
+            if isinstance(composition_id, int) else None
+        if composition is None:
+            results['comments'][i] = failed(404, 'not found', 'No such composition')
+            continue
+        comment.artist = user
+        comment.composition = composition
+        created['comments'].append((i, comment))
+
+    # The rows go in one by one, everything that follows them in bulk
+    db.session.add_all(obj for objs in created.values() for _, obj in objs)
+    with deferred_row_work(db.session):
+        db.session.flush()
+    connection = db.session.connection()
+    for name, model in (('compositions', Composition), ('comments', Comment)):
+        if created[name]:
+            model.on_inserted_many(connection, [obj for _, obj in created[name]])
+
+    # Read before the commit expires them, which would cost a SELECT each
+    for name, endpoint in (('compositions', 'api.get_composition'),
+                           ('comments', 'api.get_comment')):
+        for i, obj in created[name]:
+            results[name][i] = {'status': 201, 'url': api_url(endpoint, obj.id)}
+    db.session.commit()
+    return jsonify(results)
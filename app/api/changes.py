@@ -0,0 +1,33 @@
+from flask import current_app, request, url_for
+from . import api
+from ..exceptions import ValidationError
+from ..models import Change
+from ..serialization import jsonify
+
+
+@api.route('/changes')
+def get_changes():
+    """
+    Everything created, updated or deleted after change ?since= (0, the
+    default, is the beginning), oldest first. Pass the returned cursor as
+    the next since; more says whether another page is waiting already.
+    """
+    since = request.args.get('since', 0)
+    try:
+        since = int(since)
+    except ValueError:
+        raise ValidationError('since must be a change id')
+    per_page = current_app.config['RAGTIME_CHANGES_PER_PAGE']
+    changes = Change.query.filter(Change.id > since)\
+        .order_by(Change.id)\
+        .limit(per_page + 1)\
+        .all()
+    more = len(changes) > per_page
+    changes = changes[:per_page]
+    cursor = changes[-1].id if changes else since
+    return jsonify({
+        'changes': [change.to_json() for change in changes],
+        'cursor': cursor,
+        'more': more,
+        'next': url_for('api.get_changes', since=cursor),
+    })
@@ -1,30 +1,20 @@
-from flask import request, g, url_for, jsonify, current_app
+from flask import request, g, url_for, current_app
 from app import db
 from . import api
 from .decorators import permission_required
+from .pagination import paginated_json
 from ..models import Comment, Composition, Permission
+from ..serialization import jsonify
 
 
 @api.route('/comments/')
 def get_comments():
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.paginate(
-        page,
-        per_page=current_app.config['RAGTIME_COMMENTS_PER_PAGE'],
-        error_out=False)
-    comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_comments', page=page-1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_comments', page=page+1)
-    return jsonify({
-        'comments': [comment.to_json() for comment in comment],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    return paginated_json(Comment.query,
+                          (Comment.timestamp, Comment.id),
+                          'api.get_comments',
+                          'comments',
+                          per_page=current_app.config['RAGTIME_COMMENTS_PER_PAGE'],
+                          changes=('comment',))
 
 
 @api.route('/comments/<int:id>')
@@ -36,24 +26,14 @@ def get_comment(id):
 @api.route('/compositions/<int:id>/comments/')
 def get_composition_comments(id):
     composition = Composition.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = composition.comments.order_by(Comment.timestamp.asc()).paginate(
-        page,
-        per_page=current_app.config['RAGTIME_COMMENTS_PER_PAGE'],
-        error_out=False)
-    comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_composition_comments', id=id, page=page-1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_composition_comments', id=id, page=page+1)
-    return jsonify({
-        'comments': [comment.to_json() for comment in comments],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    return paginated_json(composition.comments,
+                          (Comment.timestamp, Comment.id),
+                          'api.get_composition_comments',
+                          'comments',
+                          per_page=current_app.config['RAGTIME_COMMENTS_PER_PAGE'],
+                          changes=('comment',),
+                          descending=False,
+                          id=id)
 
 
 @api.route('/compositions/<int:id>/comments/', methods=['POST'])
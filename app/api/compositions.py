@@ -1,9 +1,11 @@
-from flask import jsonify, url_for, request, g, current_app
+from flask import url_for, request, g, current_app
 from app import db
 from . import api
 from .errors import forbidden
 from .decorators import permission_required
+from .pagination import paginated_json
 from ..models import Composition, User, Permission
+from ..serialization import jsonify
 
 @api.route('/compositions/')
 def get_compositions():
@@ -13,24 +15,12 @@ def get_compositions():
     return jsonify({ 'compositions': [composition.to_json()
                                       for composition in compositions]})
     """
-    page = request.args.get('page', 1, type=int)
-    pagination = Composition.query.paginate(
-        page,
-        per_page=current_app.config['RAGTIME_COMPS_PER_PAGE'],
-        error_out=False)
-    compositions = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_compositions', page=page-1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_compositions', page=page+1)
-    return jsonify({
-        'compositions': [composition.to_json() for composition in compositions],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    return paginated_json(Composition.query,
+                          (Composition.timestamp, Composition.id),
+                          'api.get_compositions',
+                          'compositions',
+                          per_page=current_app.config['RAGTIME_COMPS_PER_PAGE'],
+                          changes=('composition', 'comment'))
 
 
 @api.route('/compositions/<int:id>')
@@ -60,7 +50,7 @@ def edit_composition(id):
     import json
     put_json = json.loads(request.json)
     composition.release_type = put_json.get('release_type', composition.release_type)
-    composition.title = put_json.get('release_type', composition.title)
+    composition.title = put_json.get('title', composition.title)
     composition.description = put_json.get('description', composition.description)
     db.session.add(composition)
     db.session.commit()
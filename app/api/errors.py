@@ -1,6 +1,6 @@
-from flask import jsonify
 from . import api
 from ..exceptions import ValidationError
+from ..serialization import jsonify
 
 
 def bad_request(message):
@@ -0,0 +1,20 @@
+from flask import current_app, request, stream_with_context
+from . import api
+from .. import export
+
+
+@api.route('/export/<any(compositions, comments, users):table>.ndjson')
+def export_table(table):
+    """
+    The whole table as NDJSON, streamed row by row. Compressed on the fly
+    for clients that accept gzip.
+    """
+    chunks = export.ndjson(export.table_query(table),
+                           chunk_size=current_app.config['RAGTIME_EXPORT_CHUNK_SIZE'])
+    headers = {'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip']:
+        chunks = export.gzip(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return current_app.response_class(stream_with_context(chunks),
+                                      mimetype=export.MIMETYPE,
+                                      headers=headers)
@@ -0,0 +1,109 @@
+import hashlib
+from flask import current_app, request, url_for
+from ..exceptions import ValidationError
+from .. import rendering
+from ..models import Change, User
+from ..pagination import paginate
+from ..serialization import jsonify
+
+# What ?embed= can inline, and the foreign key and model it is loaded by
+EMBEDS = {'artist': ('artist_id', User)}
+
+
+def collection_etag(changes):
+    """
+    A weak ETag for this request's view of a collection built from the
+    change log kinds in changes: it moves whenever one of those rows is
+    created, updated or deleted (see Change.latest()), without loading,
+    counting or serializing the collection. HTML is stamped with
+    rendering.VERSION, so a re-render moves it too.
+    """
+    state = repr((request.full_path, rendering.VERSION, Change.latest(*changes)))
+    return hashlib.sha1(state.encode('utf-8')).hexdigest()
+
+
+def requested(name):
+    """The comma separated values of ?name="""
+    return [value.strip() for value in request.args.get(name, '').split(',')
+            if value.strip()]
+
+
+def serialize(items):
+    """
+    to_json() every item, trimmed to ?fields= (plus url) and with each
+    ?embed= relation inlined. Related rows are loaded with one IN query
+    per relation for the whole page, and serialized once however many
+    items share them.
+    """
+    fields = set(requested('fields'))
+    embeds = requested('embed')
+    unknown = set(embeds) - set(EMBEDS)
+    if unknown:
+        raise ValidationError(f"Can't embed {', '.join(sorted(unknown))}")
+    rows = [item.to_json() for item in items]
+    for name in embeds:
+        key, model = EMBEDS[name]
+        ids = {getattr(item, key) for item in items}
+        ids.discard(None)
+        related = {obj.id: obj.to_json()
+                   for obj in model.query.filter(model.id.in_(ids))} if ids else {}
+        for item, row in zip(items, rows):
+            row[name] = related.get(getattr(item, key))
+    if fields:
+        keep = fields | {'url'} | set(embeds)
+        rows = [{key: value for key, value in row.items() if key in keep}
+                for row in rows]
+    return rows
+
+
+def paginated_json(query, keys, endpoint, collection, per_page,
+                   descending=True, changes=None, **kwargs):
+    """
+    Paginate query and wrap it in the usual API envelope. Page-number and
+    cursor requests share the same prev/next/count keys; cursor requests
+    also get prev_cursor/next_cursor, and count is null unless ?count=1.
+
+    With changes, the change log kinds the items are made of, the response
+    gets an ETag and a matching If-None-Match is answered with 304 before
+    the page is even queried. Embedded rows aren't covered by it, so with
+    ?embed= the ETag is a hash of the body instead, compared after the
+    work is done.
+    """
+    etag = None
+    if requested('embed'):
+        changes = None
+    if changes is not None:
+        etag = collection_etag(changes)
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+    pagination = paginate(query, keys, per_page, descending=descending)
+    prev = None
+    next = None
+    envelope = {}
+    if getattr(pagination, 'is_keyset', False):
+        if pagination.has_prev:
+            prev = url_for(endpoint, cursor=pagination.prev_cursor, **kwargs)
+        if pagination.has_next:
+            next = url_for(endpoint, cursor=pagination.next_cursor, **kwargs)
+        envelope['prev_cursor'] = pagination.prev_cursor
+        envelope['next_cursor'] = pagination.next_cursor
+    else:
+        if pagination.has_prev:
+            prev = url_for(endpoint, page=pagination.page-1, **kwargs)
+        if pagination.has_next:
+            next = url_for(endpoint, page=pagination.page+1, **kwargs)
+    envelope.update({
+        collection: serialize(pagination.items),
+        'prev': prev,
+        'next': next,
+        'count': pagination.total
+    })
+    response = jsonify(envelope)
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    else:
+        response.add_etag()
+        response.make_conditional(request)
+    return response
@@ -1,6 +1,8 @@
-from flask import jsonify, url_for, request, g, current_app
+from flask import url_for, request, g, current_app
 from . import api
-from ..models import User, Composition
+from .pagination import paginated_json
+from ..models import User, Composition, TimelineEntry
+from ..serialization import jsonify
 
 
 @api.route('/users/<int:id>')
@@ -12,44 +14,22 @@ def get_user(id):
 @api.route('/users/<int:id>/compositions/')
 def get_user_compositions(id):
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.compositions.order_by(Composition.timestamp.desc()).paginate(
-        page,
-        per_page=current_app.config['RAGTIME_COMPS_PER_PAGE'],
-        error_out=False)
-    compositions = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_compositions', id=id, page=page-1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_user_compositions', id=id, page=page+1)
-    return jsonify({
-        'compositions': [composition.to_json() for composition in compositions],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    return paginated_json(user.compositions,
+                          (Composition.timestamp, Composition.id),
+                          'api.get_user_compositions',
+                          'compositions',
+                          per_page=current_app.config['RAGTIME_COMPS_PER_PAGE'],
+                          changes=('composition', 'comment'),
+                          id=id)
 
 
 @api.route('/users/<int:id>/timeline/')
 def get_user_followed(id):
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed_compositions.order_by(Composition.timestamp.desc()).paginate(
-        page,
-        per_page=current_app.config['RAGTIME_COMPS_PER_PAGE'],
-        error_out=False)
-    compositions = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_compositions', id=id, page=page-1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_user_compositions', id=id, page=page+1)
-    return jsonify({
-        'compositions': [composition.to_json() for composition in compositions],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
\ No newline at end of file
+    return paginated_json(user.followed_compositions,
+                          (TimelineEntry.timestamp, TimelineEntry.composition_id),
+                          'api.get_user_followed',
+                          'compositions',
+                          per_page=current_app.config['RAGTIME_COMPS_PER_PAGE'],
+                          changes=('composition', 'comment', 'follow', 'timeline'),
+                          id=id)
@@ -2,7 +2,7 @@ from flask import render_template, url_for, redirect, url_for, flash, request, c
 from flask_login import login_user, logout_user, current_user, login_required
 from . import auth
 from .forms import LoginForm, RegistrationForm
-from ..email import send_email
+from ..email import send_email, enqueue_signup_emails
 from ..models import User
 from .. import db
 from ..decorators import log_visit
@@ -49,25 +49,14 @@ def register():
                    username=form.username.data,
                    password=form.password.data)
         db.session.add(user)
+        db.session.flush()
+        # since form input is valid (not an existing user, etc),
+        # we can send them a welcome email. The jobs commit with the user
+        # and the mail goes out after we have answered.
+        enqueue_signup_emails(user)
         db.session.commit()
         flash("Coolio. Now you can login.")
-        # since form input is valid (not an existing user, etc),
-        # we can send them a welcome email
-        send_email(form.email.data,
-                    'Welcome to Ragtime!',
-                    'mail/welcome',
-                    user=user)
         flash("We sent you a confirmation email! Click the link in the email to confirm your account.")
-        send_email(form.email.data,
-                    'Confirm Your Account',
-                    'auth/email/confirm',
-                    user=user,
-                    token=user.generate_confirmation_token())
-        if current_app.config['RAGTIME_ADMIN']:
-            send_email(current_app.config['RAGTIME_ADMIN'],
-                        'New User',
-                        'mail/new_user',
-                        user=user)
         return redirect(url_for('main.home'))
     return render_template('auth/register.html', form=form)
 
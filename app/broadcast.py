@@ -0,0 +1,126 @@
+import json
+from collections import defaultdict
+from queue import Empty, Full, Queue
+from threading import Lock
+
+
+class Subscription:
+    """One connected client: a bounded queue of events for one user"""
+
+    def __init__(self, broadcaster, user_id, following, maxsize):
+        self.broadcaster = broadcaster
+        self.user_id = user_id
+        self.following = set(following)
+        self.queue = Queue(maxsize)
+        # Set when events had to be dropped; the client should reload
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except Full:
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        """The next event, or None if there was none within timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Broadcaster:
+    """
+    Pushes new compositions to the connected followers of their artist,
+    for the Server-Sent Events stream in main.timeline_events.
+
+    Every connected client is a Subscription with its own bounded queue,
+    indexed by the artists its user follows. Those are read once when the
+    client connects and then kept current by the Follow listeners in
+    models.py, so publishing is a dictionary lookup and a put per
+    follower, with no database work at all. A client too slow to keep up
+    loses events rather than growing its queue, and is told to reload.
+
+    State is per process: publish() reaches the clients connected to this
+    worker. It is called from the after_commit listener in models.py, and
+    tests can call it directly.
+    """
+
+    def __init__(self, app=None):
+        self._by_artist = defaultdict(set)
+        self._by_user = defaultdict(set)
+        self._lock = Lock()
+        self.maxsize = 16
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RAGTIME_SSE_QUEUE_SIZE', 16)
+        app.config.setdefault('RAGTIME_SSE_KEEPALIVE', 15)
+        app.config.setdefault('RAGTIME_SSE_MAX_CLIENTS', 24)
+        self.maxsize = app.config['RAGTIME_SSE_QUEUE_SIZE']
+
+    def subscribe(self, user_id, following):
+        """Connect a client of user_id, who follows the artist ids in following"""
+        subscription = Subscription(self, user_id, following, self.maxsize)
+        with self._lock:
+            self._by_user[user_id].add(subscription)
+            for artist_id in subscription.following:
+                self._by_artist[artist_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._discard(self._by_user, subscription.user_id, subscription)
+            for artist_id in subscription.following:
+                self._discard(self._by_artist, artist_id, subscription)
+
+    def follow(self, follower_id, following_id):
+        with self._lock:
+            for subscription in self._by_user.get(follower_id, ()):
+                subscription.following.add(following_id)
+                self._by_artist[following_id].add(subscription)
+
+    def unfollow(self, follower_id, following_id):
+        with self._lock:
+            for subscription in self._by_user.get(follower_id, ()):
+                subscription.following.discard(following_id)
+                self._discard(self._by_artist, following_id, subscription)
+
+    def publish(self, artist_id, event):
+        """Queue event for every connected follower of artist_id"""
+        with self._lock:
+            subscriptions = list(self._by_artist.get(artist_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+        return len(subscriptions)
+
+    @property
+    def connected(self):
+        with self._lock:
+            return sum(len(s) for s in self._by_user.values())
+
+    @staticmethod
+    def _discard(index, key, subscription):
+        subscriptions = index.get(key)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del index[key]
+
+
+def format_event(data, event=None):
+    """data as one Server-Sent Events message"""
+    message = ''
+    if event is not None:
+        message += f'event: {event}\n'
+    return message + f'data: {json.dumps(data)}\n\n'
@@ -0,0 +1,88 @@
+import hashlib
+import hmac
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+from flask import current_app
+from werkzeug.security import check_password_hash
+from .cache import LRUCache
+
+
+class CredentialCache:
+    """
+    Lets HTTP Basic clients skip PBKDF2 on every call. A successful
+    (email, password) check is remembered for a short, strict ttl under an
+    HMAC of the pair keyed with the app's secret, so the cache itself
+    never holds anything that could be replayed. Entries also remember the
+    password hash they were verified against, so changing the password
+    invalidates them straight away.
+
+    The checks that do have to run go to a small process pool (when
+    RAGTIME_PASSWORD_HASH_WORKERS > 0) with at most two checks queued per
+    worker, keeping the hashing off the request threads and bounded. Its
+    workers are started by a forkserver (or spawned), never forked from
+    a request thread.
+    """
+
+    def __init__(self, app=None):
+        self.cache = LRUCache()
+        self._pool = None
+        self._slots = None
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RAGTIME_CREDENTIAL_CACHE_SIZE', 1024)
+        app.config.setdefault('RAGTIME_CREDENTIAL_CACHE_TTL', 60)
+        app.config.setdefault('RAGTIME_PASSWORD_HASH_WORKERS', 0)
+        self.cache.maxsize = app.config['RAGTIME_CREDENTIAL_CACHE_SIZE']
+        self.cache.ttl = app.config['RAGTIME_CREDENTIAL_CACHE_TTL']
+
+    @staticmethod
+    def _key(email, password):
+        secret = current_app.config['SECRET_KEY'].encode('utf-8')
+        # The email exactly as the user lookup matches it, so the cache
+        # never accepts a spelling the database would have turned down
+        message = email.encode('utf-8') + b'\0' + password.encode('utf-8')
+        return hmac.new(secret, message, hashlib.sha256).hexdigest()
+
+    def lookup(self, email, password):
+        """(user_id, password_hash) this pair was last verified against, or None"""
+        if not current_app.config['RAGTIME_CREDENTIAL_CACHE_TTL']:
+            return None
+        return self.cache.get(self._key(email, password))
+
+    def remember(self, email, password, user):
+        if current_app.config['RAGTIME_CREDENTIAL_CACHE_TTL']:
+            self.cache.set(self._key(email, password),
+                           (user.id, user.password_hash))
+
+    def check_password(self, pwhash, password):
+        """check_password_hash(), in the worker pool if there is one"""
+        workers = current_app.config['RAGTIME_PASSWORD_HASH_WORKERS']
+        if not workers:
+            return check_password_hash(pwhash, password)
+        pool, slots = self._get_pool(workers)
+        with slots:
+            return pool.submit(check_password_hash, pwhash, password).result()
+
+    def _get_pool(self, workers):
+        with self._lock:
+            if self._pool is None:
+                # Forking a threaded web process copies whatever locks other
+                # threads held; workers come from a clean server process instead
+                method = 'forkserver' if 'forkserver' in \
+                    multiprocessing.get_all_start_methods() else 'spawn'
+                self._pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context(method))
+                self._slots = BoundedSemaphore(workers * 2)
+            return self._pool, self._slots
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+            self._pool = None
+            self._slots = None
@@ -1,19 +1,64 @@
 from flask import current_app, render_template
 from flask_mail import Message
-from . import mail
-from threading import Thread
+from . import outbox
+from .jobs import enqueue, handler
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
-        current_app.logger.debug(f"sent email, from {current_app.config['RAGTIME_MAIL_SENDER']} to {msg.recipients[0]}")
 
-
-def send_email(to, subject, template, **kwargs):
+def build_email(to, subject, template, **kwargs):
     msg = Message(subject=current_app.config['RAGTIME_MAIL_SUBJECT_PREFIX'] + subject,
                   recipients=[to],
                   sender=current_app.config['RAGTIME_MAIL_SENDER'])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
-    thread = Thread(target=send_async_email, args=[current_app._get_current_object(), msg])
-    thread.start()
\ No newline at end of file
+    return msg
+
+
+def send_email(to, subject, template, **kwargs):
+    # Delivered by the outbox's worker pool, see outbox.py
+    outbox.send(build_email(to, subject, template, **kwargs))
+    current_app.logger.debug(f"queued email, from {current_app.config['RAGTIME_MAIL_SENDER']} to {to}")
+
+
+# What a new user gets, by kind: recipient ('user' or 'admin'), subject, template
+SIGNUP_EMAILS = {
+    'welcome': ('user', 'Welcome to Ragtime!', 'mail/welcome'),
+    'confirm': ('user', 'Confirm Your Account', 'auth/email/confirm'),
+    'new_user': ('admin', 'New User', 'mail/new_user'),
+}
+
+
+def enqueue_signup_emails(user):
+    """
+    One job per signup mail, each with its own key, so a retry only
+    resends the mail that failed. Commits with user, who needs an id.
+    """
+    for kind, (recipient, _, _) in SIGNUP_EMAILS.items():
+        if recipient == 'admin' and not current_app.config['RAGTIME_ADMIN']:
+            continue
+        enqueue('signup_email', {'user_id': user.id, 'kind': kind},
+                priority=10, key=f'signup-{kind}-{user.id}')
+
+
+@handler('signup_email')
+def signup_email(user_id, kind):
+    """
+    Hand one signup mail to the outbox, see SIGNUP_EMAILS.
+
+    The job is done once the outbox accepts the mail, and that is where
+    its durability ends: the outbox keeps messages in memory, so one
+    still queued when the process dies, or failing past the outbox's
+    own retries, is lost and not retried by the job. Only a full outbox
+    fails the job.
+    """
+    from .models import User
+    user = User.query.get(user_id)
+    if user is None:
+        return
+    recipient, subject, template = SIGNUP_EMAILS[kind]
+    to = user.email if recipient == 'user' else current_app.config['RAGTIME_ADMIN']
+    kwargs = {'user': user}
+    if kind == 'confirm':
+        kwargs['token'] = user.generate_confirmation_token()
+    if not outbox.send(build_email(to, subject, template, **kwargs)):
+        # The outbox was full; try again later rather than lose it
+        raise RuntimeError(f'Mail queue full, {kind} mail to user {user_id} not sent')
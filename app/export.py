@@ -0,0 +1,53 @@
+"""
+Bulk NDJSON dumps of whole tables, for the export API and `flask export`.
+
+Rows are read in primary key order through yield_per() with
+stream_results, so the database hands them over in batches through a
+server-side cursor where it has one (PostgreSQL) instead of the driver
+buffering the whole result. Each row is serialized on its own and
+yielded as one line; nothing holds on to rows already written, so memory
+stays flat however big the table is. gzip() compresses such a stream
+incrementally.
+"""
+import zlib
+from .models import Comment, Composition, User
+from .serialization import dumps
+
+MIMETYPE = 'application/x-ndjson'
+
+# What can be exported, and in which order
+TABLES = {
+    'compositions': (Composition, Composition.id),
+    'comments': (Comment, Comment.id),
+    'users': (User, User.id),
+}
+
+
+def table_query(name):
+    model, order = TABLES[name]
+    return model.query.order_by(order)
+
+
+def ndjson(query, chunk_size=1000):
+    """Yield every row of query as one line of JSON (bytes)"""
+    rows = query.execution_options(stream_results=True).yield_per(chunk_size)
+    for row in rows:
+        yield dumps(row.to_json(), compact=True)
+
+
+def gzip(chunks, level=6, flush_every=64 * 1024):
+    """
+    gzip-compress an iterable of bytes as it goes. Output is flushed every
+    flush_every input bytes so readers don't wait for the end of the dump.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_every:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
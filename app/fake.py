@@ -1,8 +1,15 @@
-from random import randint
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+from hashlib import md5
+from itertools import islice
+from random import Random, randint
 from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
 from faker import Faker
 from . import db
-from .models import User, Composition, Comment
+from . import rendering
+from .models import User, Role, Composition, Comment, TimelineEntry, Change
 
 def create_fake_data():
     users()
@@ -45,8 +52,6 @@ def compositions(count=200):
                         artist=u)
         db.session.add(c)
     db.session.commit()
-    for c in Composition.query.all():
-        c.generate_slug()
 
 
 def comments(count=1000):
@@ -62,3 +67,157 @@ def comments(count=1000):
                           composition=c)
         db.session.add(c)
     db.session.commit()
+
+
+# Bulk mode, for load testing at production scale. Rows are built as
+# plain mappings and written chunk_size at a time with
+# bulk_insert_mappings (one executemany per chunk), random authors and
+# compositions are drawn from id arrays loaded once, and what the ORM
+# events would have done per row is done in bulk instead: counters are
+# tallied while generating and added with one executemany, self-follows
+# and timelines are INSERT ... SELECTs, slugs are a single UPDATE, and
+# HTML is rendered in chunks afterwards. The same seed (and epoch, the
+# moment every timestamp is counted back from) always produces the same
+# rows.
+
+EPOCH = datetime(2020, 1, 1)
+
+def create_bulk_fake_data(users=1000, compositions=10000, comments=100000,
+                          seed=0, chunk_size=5000, workers=0, progress=None,
+                          epoch=EPOCH):
+    """
+    Needs a request context (or SERVER_NAME) for the mention links in
+    descriptions, like `flask rerender`. progress, if given, is called
+    with a step name and the number of rows it has done so far.
+    """
+    fake = Faker()
+    fake.seed_instance(seed)
+    rng = Random(seed)
+    progress = progress or _quiet
+    bulk_users(users, fake, rng, chunk_size, progress, epoch)
+    user_ids = _ids(User)
+    bulk_compositions(compositions, user_ids, fake, rng, chunk_size, progress, epoch)
+    bulk_comments(comments, user_ids, _ids(Composition), fake, rng, chunk_size,
+                  progress, epoch)
+    for step, batches in (
+            ('slugs', [Composition.fill_slugs()]),
+            ('descriptions', rendering.rerender_descriptions(
+                Composition, chunk_size=chunk_size, workers=workers)),
+            ('comment bodies', rendering.rerender_comments(
+                Comment, chunk_size=chunk_size, workers=workers))):
+        done = 0
+        for count in batches:
+            done += count
+            progress(step, done)
+    # Bulk inserts skip log_changes(), the timelines log their own reset
+    Change.log_reset('composition', 'comment')
+    TimelineEntry.rebuild()
+    progress('timelines', 1)
+
+
+def _quiet(step, done):
+    pass
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _insert(model, rows, chunk_size, progress):
+    done = 0
+    for chunk in _chunks(rows, chunk_size):
+        db.session.bulk_insert_mappings(model, chunk)
+        db.session.commit()
+        done += len(chunk)
+        progress(model.__tablename__, done)
+    return done
+
+
+def _add_counts(column, counts, chunk_size):
+    """Add counts ({id: n}) to a counter column, chunk_size rows per executemany"""
+    table = column.class_.__table__
+    update = table.update()\
+        .where(table.c.id == db.bindparam('_id'))\
+        .values({column.key: column + db.bindparam('_n')})
+    for chunk in _chunks(counts.items(), chunk_size):
+        db.session.execute(update, [{'_id': id, '_n': n} for id, n in chunk])
+    db.session.commit()
+
+
+def _ids(model):
+    """Every id of model, in a compact array to pick random rows from"""
+    return array('q', (id for id, in db.session.query(model.id)
+                       .order_by(model.id).yield_per(10000)))
+
+
+def _past(rng, epoch):
+    """Some time in the year before epoch"""
+    return epoch - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+
+
+def bulk_users(count, fake, rng, chunk_size=5000, progress=None, epoch=EPOCH):
+    role = Role.query.filter_by(default=True).first()
+    # Hashing is deliberately slow, and every fake user has the same password
+    password_hash = generate_password_hash('password')
+    # Suffixing a number keeps usernames and emails unique without retries
+    start = db.session.query(db.func.max(User.id)).scalar() or 0
+
+    def rows():
+        for i in range(start + 1, start + count + 1):
+            username = f'{fake.user_name()}{i}'
+            email = f'{username}@{fake.free_email_domain()}'
+            yield {'username': username,
+                   'email': email,
+                   'avatar_hash': md5(email.encode('utf-8')).hexdigest(),
+                   'password_hash': password_hash,
+                   'confirmed': True,
+                   'role_id': role.id if role else None,
+                   'permissions': role.permissions if role else 0,
+                   'name': fake.name(),
+                   'location': fake.city(),
+                   'bio': fake.text(),
+                   'last_seen': _past(rng, epoch)}
+    done = _insert(User, rows(), chunk_size, progress or _quiet)
+    User.add_self_follows()
+    return done
+
+
+def bulk_compositions(count, user_ids, fake, rng, chunk_size=5000, progress=None,
+                      epoch=EPOCH):
+    counts = Counter()
+
+    def rows():
+        for _ in range(count):
+            artist_id = rng.choice(user_ids)
+            counts[artist_id] += 1
+            yield {'release_type': rng.randint(0, 2),
+                   'title': fake.bs(),
+                   'description': fake.text(),
+                   'timestamp': _past(rng, epoch),
+                   'artist_id': artist_id}
+    done = _insert(Composition, rows(), chunk_size, progress or _quiet)
+    _add_counts(User.composition_count, counts, chunk_size)
+    return done
+
+
+def bulk_comments(count, user_ids, composition_ids, fake, rng, chunk_size=5000,
+                  progress=None, epoch=EPOCH):
+    counts = Counter()
+
+    def rows():
+        for _ in range(count):
+            composition_id = rng.choice(composition_ids)
+            counts[composition_id] += 1
+            yield {'body': fake.text(max_nb_chars=200),
+                   'timestamp': _past(rng, epoch),
+                   'artist_id': rng.choice(user_ids),
+                   'composition_id': composition_id}
+    done = _insert(Comment, rows(), chunk_size, progress or _quiet)
+    _add_counts(Composition.comment_count, counts, chunk_size)
+    return done
+
@@ -0,0 +1,64 @@
+from flask import render_template
+from flask_login import current_user
+from jinja2 import Markup
+from .cache import LRUCache
+
+
+class FragmentCache:
+    """
+    Caches the rendered HTML of single list items (_composition.html and
+    _comment.html) so feeds are stitched together from ready-made pieces
+    instead of re-rendering every item for every viewer.
+
+    Keys hold everything an item's markup depends on: the row's id,
+    updated_at and counters, and the viewer's role class (are they the
+    artist, an administrator, moderating). Edits therefore miss the cache
+    by themselves; the update/delete listeners at the bottom of models.py
+    also evict eagerly, which is what catches artist changes (username,
+    avatar) shown inside other rows' fragments.
+    """
+
+    def __init__(self, app=None):
+        self.cache = LRUCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RAGTIME_FRAGMENT_CACHE_SIZE', 4096)
+        app.config.setdefault('RAGTIME_FRAGMENT_CACHE_TTL', 300)
+        self.cache.maxsize = app.config['RAGTIME_FRAGMENT_CACHE_SIZE']
+        self.cache.ttl = app.config['RAGTIME_FRAGMENT_CACHE_TTL']
+        app.add_template_global(self.composition, 'cached_composition')
+        app.add_template_global(self.comment, 'cached_comment')
+
+    def _render(self, key, template, **context):
+        html = self.cache.get(key)
+        if html is None:
+            html = Markup(render_template(template, **context))
+            self.cache.set(key, html)
+        return html
+
+    def composition(self, composition):
+        viewer = (current_user.is_authenticated and
+                  current_user.id == composition.artist_id,
+                  current_user.is_administrator())
+        key = ('composition', composition.id, composition.artist_id,
+               composition.updated_at, composition.comment_count, viewer)
+        return self._render(key, '_composition.html', composition=composition)
+
+    def comment(self, comment, moderate=False, page=None):
+        # Only the moderation view links to anything page-dependent
+        view = (True, page) if moderate else (False, None)
+        key = ('comment', comment.id, comment.artist_id,
+               comment.updated_at, comment.disabled, view)
+        return self._render(key, '_comment.html',
+                            comment=comment, moderate=moderate, page=page)
+
+    def forget(self, kind, id):
+        self.cache.discard_where(lambda key: key[:2] == (kind, id))
+
+    def forget_artist(self, artist_id):
+        self.cache.discard_where(lambda key: key[2] == artist_id)
+
+    def clear(self):
+        self.cache.clear()
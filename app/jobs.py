@@ -0,0 +1,207 @@
+"""
+Durable background jobs.
+
+Code that has follow-up work to do after a request calls enqueue(),
+which adds a Job row to the current session, so the job commits (or
+rolls back) together with the data it is about. A JobRunner then claims
+due jobs, highest priority first, and runs their handlers on a thread
+pool, each in its own app and request context:
+
+    @handler('signup_emails')
+    def signup_emails(user_id):
+        ...
+
+    enqueue('signup_emails', {'user_id': user.id}, key=f'signup-emails-{user.id}')
+
+Handlers run in a request context for the site root of the request that
+enqueued them, so url_for(_external=True) links point where the user
+came from. Jobs enqueued outside a request use RAGTIME_BASE_URL.
+
+Handlers must be safe to run twice: a job whose worker dies is claimed
+again once its lease (RAGTIME_JOB_LEASE seconds) expires, and a failing
+job is retried with exponential backoff until max_attempts. A key makes
+enqueueing idempotent.
+
+The runner works inside the web process when RAGTIME_JOB_WORKERS > 0,
+started by the first request and woken up by every commit that
+enqueued something, and under `flask worker` otherwise.
+"""
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from flask import current_app, has_request_context, request
+
+_handlers = {}
+
+
+def handler(name):
+    """Register the decorated function as the handler of jobs called name"""
+    def decorator(f):
+        _handlers[name] = f
+        return f
+    return decorator
+
+
+def enqueue(name, payload=None, priority=0, key=None, delay=0, max_attempts=None):
+    """
+    Add a job to the current session; it is created when that commits.
+    With a key, a job already enqueued under it is returned instead.
+    """
+    from . import db
+    from .models import Job
+    if name not in _handlers:
+        raise KeyError(f'No handler for job {name!r}')
+    if key is not None:
+        existing = Job.query.filter_by(key=key).first()
+        if existing is not None:
+            return existing
+    job = Job(name=name,
+              payload=json.dumps(payload or {}),
+              priority=priority,
+              key=key,
+              base_url=request.url_root if has_request_context() else None,
+              run_at=datetime.utcnow() + timedelta(seconds=delay),
+              max_attempts=max_attempts or current_app.config['RAGTIME_JOB_MAX_ATTEMPTS'])
+    db.session.add(job)
+    db.session.info['jobs_enqueued'] = True
+    return job
+
+
+class JobRunner:
+    """Claims and runs due jobs, see the module docstring"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._wake = Event()
+        self._lock = Lock()
+        self._thread = None
+        self._stopping = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RAGTIME_JOB_WORKERS', 0)
+        app.config.setdefault('RAGTIME_JOB_POLL_INTERVAL', 5.0)
+        app.config.setdefault('RAGTIME_JOB_LEASE', 300)
+        app.config.setdefault('RAGTIME_JOB_MAX_ATTEMPTS', 5)
+        app.config.setdefault('RAGTIME_JOB_BACKOFF', 10)
+        self.app = app
+        # Jobs left over from before a restart, or waiting out a lease or
+        # a backoff, are due whether or not anything new gets enqueued
+        app.before_first_request(self.start)
+
+    def start(self):
+        """Start the in-process runner, unless it runs or is turned off"""
+        workers = self.app.config['RAGTIME_JOB_WORKERS']
+        if not workers:
+            return False
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = Thread(target=self.run, args=(workers,),
+                                      name='job-runner', daemon=True)
+                self._thread.start()
+        return True
+
+    def wake(self):
+        """Something was enqueued: start the in-process runner or nudge it"""
+        if self.start():
+            self._wake.set()
+
+    def run(self, workers, once=False):
+        """Run jobs until stop(), or until none are due if once"""
+        poll = self.app.config['RAGTIME_JOB_POLL_INTERVAL']
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while not self._stopping:
+                self._wake.clear()
+                jobs = self.claim(workers)
+                if jobs:
+                    for _ in executor.map(self.execute, jobs):
+                        pass
+                    continue
+                if once:
+                    return
+                self._wake.wait(poll)
+
+    def run_pending(self, limit=100):
+        """Run due jobs in this thread, one after the other; how many ran"""
+        count = 0
+        while count < limit:
+            jobs = self.claim(min(10, limit - count))
+            if not jobs:
+                break
+            for job in jobs:
+                self.execute(job)
+            count += len(jobs)
+        return count
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+    def claim(self, limit):
+        """
+        Take up to limit due jobs: queued ones whose time has come and
+        running ones whose lease ran out. Each is claimed with a
+        conditional UPDATE, so two runners never get the same job.
+        Returns (id, name, payload, base_url) tuples.
+        """
+        from . import db
+        from .models import Job
+        jobs = Job.__table__
+        now = datetime.utcnow()
+        lease = timedelta(seconds=self.app.config['RAGTIME_JOB_LEASE'])
+        claimed = []
+        with self.app.app_context(), db.engine.begin() as connection:
+            due = connection.execute(
+                db.select([jobs.c.id, jobs.c.name, jobs.c.payload, jobs.c.base_url,
+                           jobs.c.status, jobs.c.run_at])
+                .where(db.and_(jobs.c.status.in_(['queued', 'running']),
+                               jobs.c.run_at <= now))
+                .order_by(jobs.c.priority.desc(), jobs.c.run_at, jobs.c.id)
+                .limit(limit)).fetchall()
+            for id, name, payload, base_url, status, run_at in due:
+                result = connection.execute(
+                    jobs.update()
+                    .where(db.and_(jobs.c.id == id,
+                                   jobs.c.status == status,
+                                   jobs.c.run_at == run_at))
+                    .values(status='running', run_at=now + lease,
+                            attempts=jobs.c.attempts + 1))
+                if result.rowcount == 1:
+                    claimed.append((id, name, payload, base_url))
+        return claimed
+
+    def execute(self, job):
+        from . import db
+        from .models import Job
+        id, name, payload, base_url = job
+        jobs = Job.__table__
+        base_url = base_url or self.app.config.get('RAGTIME_BASE_URL')
+        with self.app.test_request_context(base_url=base_url):
+            try:
+                _handlers[name](**json.loads(payload))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                error = traceback.format_exc()
+                self.app.logger.exception(f'Job {id} ({name}) failed')
+                with db.engine.begin() as connection:
+                    attempts, max_attempts = connection.execute(
+                        db.select([jobs.c.attempts, jobs.c.max_attempts])
+                        .where(jobs.c.id == id)).first()
+                    if attempts >= max_attempts:
+                        values = {'status': 'failed', 'finished_at': datetime.utcnow()}
+                    else:
+                        backoff = self.app.config['RAGTIME_JOB_BACKOFF'] * 2 ** (attempts - 1)
+                        values = {'status': 'queued',
+                                  'run_at': datetime.utcnow() + timedelta(seconds=backoff)}
+                    connection.execute(jobs.update().where(jobs.c.id == id)
+                                       .values(last_error=error, **values))
+                return False
+            with db.engine.begin() as connection:
+                connection.execute(jobs.update().where(jobs.c.id == id)
+                                   .values(status='done', finished_at=datetime.utcnow()))
+            return True
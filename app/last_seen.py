@@ -0,0 +1,89 @@
+import atexit
+from datetime import datetime, timedelta
+from threading import Lock
+from time import monotonic
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+class LastSeenTracker:
+    """
+    Coalesces last_seen writes. Pinging a user only records the time in
+    memory, and only when what we have is older than the configured
+    granularity; pending times are written out together in one batched
+    UPDATE, at most once per flush interval, when a request tears down.
+    """
+
+    def __init__(self, app=None):
+        self._pending = {}
+        self._lock = Lock()
+        self._last_flush = monotonic()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RAGTIME_LAST_SEEN_GRANULARITY', 60)
+        app.config.setdefault('RAGTIME_LAST_SEEN_FLUSH_INTERVAL', 10)
+        app.teardown_request(self._teardown_request)
+        atexit.register(self._flush_at_exit, app)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def touch(self, user):
+        """Note that user was just seen, if we haven't done so lately"""
+        now = datetime.utcnow()
+        granularity = timedelta(
+            seconds=current_app.config['RAGTIME_LAST_SEEN_GRANULARITY'])
+        stored = user.last_seen
+        with self._lock:
+            # What's pending is newer than whatever the row still says
+            seen = self._pending.get(user.id) or stored
+            if seen is None or now - seen >= granularity:
+                seen = self._pending[user.id] = now
+        # Show the latest time in this request without making the user dirty
+        set_committed_value(user, 'last_seen', seen)
+
+    def flush(self):
+        """Write all pending times in one statement, outside the request's session"""
+        from . import db
+        from .models import User
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = monotonic()
+        if not pending:
+            return 0
+        statement = User.__table__.update()\
+            .where(User.id == bindparam('_id'))\
+            .values(last_seen=bindparam('_last_seen'))
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(statement, [{'_id': id, '_last_seen': seen}
+                                               for id, seen in pending.items()])
+        except SQLAlchemyError:
+            # Put them back unless something newer arrived meanwhile
+            with self._lock:
+                for id, seen in pending.items():
+                    self._pending.setdefault(id, seen)
+            raise
+        return len(pending)
+
+    def _teardown_request(self, exc):
+        interval = current_app.config['RAGTIME_LAST_SEEN_FLUSH_INTERVAL']
+        if not self._pending or monotonic() - self._last_flush < interval:
+            return
+        try:
+            self.flush()
+        except SQLAlchemyError:
+            current_app.logger.exception("Couldn't flush last_seen times")
+
+    def _flush_at_exit(self, app):
+        if self._pending:
+            with app.app_context():
+                try:
+                    self.flush()
+                except SQLAlchemyError:
+                    pass
@@ -1,6 +1,7 @@
 from flask import render_template, request, jsonify
 from werkzeug.exceptions import NotFound, InternalServerError, Forbidden
 from . import main
+from ..exceptions import ValidationError
 
 @main.app_errorhandler(NotFound)
 def page_not_found(e):
@@ -33,3 +34,13 @@ def forbidden(e):
         return response
     error_msg="This page is forbidden, you're not supposed to be here. Shoo, off you go!"
     return render_template("error.html", error_msg=error_msg), 403
+
+
+@main.app_errorhandler(ValidationError)
+def bad_request(e):
+    if request.accept_mimetypes.accept_json and \
+            not request.accept_mimetypes.accept_html:
+        response = jsonify({'error': 'bad request', 'message': e.args[0]})
+        response.status_code = 400
+        return response
+    return render_template("error.html", error_msg=e.args[0]), 400
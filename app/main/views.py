@@ -1,19 +1,25 @@
-from flask import session, render_template, redirect, url_for, flash, current_app, request, abort, make_response
+from flask import session, render_template, redirect, url_for, flash, current_app, request, abort, make_response, \
+    stream_with_context
 from flask_login import login_required, current_user
 from . import main
 from .forms import NameForm, EditProfileForm, EditProfileAdminForm, CompositionForm, CommentForm
-from .. import db
-from ..models import User, Role, Permission, Composition, Comment
+from .. import db, queries, page_cache, broadcaster
+from ..broadcast import format_event
+from ..models import User, Role, Permission, Composition, Comment, Follow, TimelineEntry
+from ..pagination import paginate
 from ..email import send_email
 from ..decorators import admin_required, permission_required, log_visit
 
 
 @main.route('/', methods=['GET', 'POST'])
 @log_visit
+@page_cache.cached
 def home():
     """How the page BEHAVES"""
-    form = CompositionForm()
-    if current_user.can(Permission.PUBLISH) and form.validate_on_submit():
+    # Building a form issues a CSRF token into the session, which would
+    # make the page uncacheable for everyone who can't use the form anyway
+    form = CompositionForm() if current_user.can(Permission.PUBLISH) else None
+    if form is not None and form.validate_on_submit():
         composition = Composition(release_type=form.release_type.data,
                                   title=form.title.data,
                                   description=form.description.data,
@@ -21,29 +27,26 @@ def home():
                                   artist=current_user._get_current_object())
         db.session.add(composition)
         db.session.commit()
-        # must be generated after first commit
-        composition.generate_slug()
         return redirect(url_for('.home'))
-    # page number to render, from request's query string 'page',
-    # with default of first page (1), and if type can't be int,
-    # return default value
-    page = request.args.get('page', 1, type=int)
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
     if show_followed:
-        query = current_user.followed_compositions
+        # Read from the materialized timeline, keyed the same way
+        query = queries.followed_compositions(current_user)
+        keys = (TimelineEntry.timestamp, TimelineEntry.composition_id)
     else:
-        query = Composition.query
+        query = queries.compositions()
+        keys = (Composition.timestamp, Composition.id)
     # Which page of results do you want? We'll display <per_page> results, and won't
     # throw an error if you go outside how many pages we have!
-    # NOTE: We may use a different query if show followed is true
-    #pagination = Composition.query.order_by(Composition.timestamp.desc()).paginate(
-    pagination = query.order_by(Composition.timestamp.desc()).paginate(
-        page,
-        per_page=current_app.config['RAGTIME_COMPS_PER_PAGE'],
-        error_out=False)
+    # ?page=N works as it always has, ?cursor=... walks by (timestamp, id)
+    pagination = paginate(query,
+                          keys,
+                          per_page=current_app.config['RAGTIME_COMPS_PER_PAGE'])
     compositions = pagination.items
+    page_cache.tag('compositions')
+    page_cache.depends_on(*compositions)
     # A ?page=2 will display in address when page selected is 2
     return render_template(
         'home.html',
@@ -56,18 +59,27 @@ def home():
 
 @main.route('/user/<username>')
 @log_visit
+@page_cache.cached
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
-    compositions = user.compositions.order_by(Composition.timestamp.desc()).all()
+    compositions = queries.user_compositions(user)\
+        .order_by(Composition.timestamp.desc()).all()
+    page_cache.depends_on(user, *compositions)
     return render_template('user.html', user=user, compositions=compositions)
 
 
 @main.route('/composition/<slug>', methods=['GET', 'POST'])
 @log_visit
+@page_cache.cached
 def composition(slug):
-    composition = Composition.query.filter_by(slug=slug).first_or_404()
-    form = CommentForm()
-    if form.validate_on_submit():
+    composition = Composition.from_slug(slug)
+    if composition is None:
+        abort(404)
+    if composition.slug != slug and request.method == 'GET':
+        return redirect(url_for('.composition', slug=composition.slug,
+                                page=request.args.get('page')), 301)
+    form = CommentForm() if current_user.can(Permission.COMMENT) else None
+    if form is not None and form.validate_on_submit():
         comment = Comment(body=form.body.data,
                           composition=composition,
                           artist=current_user._get_current_object())
@@ -78,13 +90,15 @@ def composition(slug):
     page = request.args.get('page', 1, type=int)
     if page == -1:
         # Calculate last page number
-        page = (composition.comments.count() - 1) // \
+        page = (composition.comment_count - 1) // \
                current_app.config['RAGTIME_COMMENTS_PER_PAGE'] + 1
-    pagination = composition.comments.order_by(Comment.timestamp.asc()).paginate(
-        page,
-        per_page=current_app.config['RAGTIME_COMMENTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(queries.composition_comments(composition),
+                          (Comment.timestamp, Comment.id),
+                          per_page=current_app.config['RAGTIME_COMMENTS_PER_PAGE'],
+                          descending=False,
+                          page=page)
     comments = pagination.items
+    page_cache.depends_on(composition, *comments)
     # Use list so we can pass to _compositions template
     return render_template('composition.html',
                            compositions=[composition],
@@ -97,7 +111,11 @@ def composition(slug):
 @login_required
 @log_visit
 def edit_composition(slug):
-    composition = Composition.query.filter_by(slug=slug).first_or_404()
+    composition = Composition.from_slug(slug)
+    if composition is None:
+        abort(404)
+    if composition.slug != slug and request.method == 'GET':
+        return redirect(url_for('.edit_composition', slug=composition.slug), 301)
     if current_user != composition.artist and \
             not current_user.can(Permission.ADMIN):
         abort(403)
@@ -106,9 +124,6 @@ def edit_composition(slug):
         composition.release_type = form.release_type.data
         composition.title = form.title.data
         composition.description = form.description.data
-        # regenerate in case the title changed
-        composition.generate_slug()
-        db.session.add(composition)
         db.session.commit()
         flash("Your composition was updated!")
         return redirect(url_for('.composition', slug=composition.slug))
@@ -214,11 +229,9 @@ def followers(username):
     if user is None:
         flash("That is not a valid user.")
         return redirect(url_for('.home'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followers.paginate(
-        page,
-        per_page=current_app.config['RAGTIME_FOLLOWERS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(queries.followers(user),
+                          (Follow.timestamp, Follow.follower_id),
+                          per_page=current_app.config['RAGTIME_FOLLOWERS_PER_PAGE'])
     # convert to only follower and timestamp
     follows = [{'user': item.follower, 'timestamp': item.timestamp}
                for item in pagination.items]
@@ -239,18 +252,16 @@ def following(username):
     if user is None:
         flash("That is not a valid user.")
         return redirect(url_for('.home'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.following.paginate(
-        page,
-        per_page=current_app.config['RAGTIME_FOLLOWING_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(queries.following(user),
+                          (Follow.timestamp, Follow.following_id),
+                          per_page=current_app.config['RAGTIME_FOLLOWING_PER_PAGE'])
     # convert to only following and timestamp
     following = [{'user': item.following, 'timestamp': item.timestamp}
                for item in pagination.items]
     return render_template('followers.html',
                            user=user,
                            title="Followed by",
-                           endpoint='.followers',
+                           endpoint='.following',
                            pagination=pagination,
                            follows=following)
 
@@ -273,16 +284,51 @@ def show_followed():
     return resp
 
 
+@main.route('/timeline/events')
+@login_required
+@log_visit
+def timeline_events():
+    """
+    Server-Sent Events: a 'composition' event whenever an artist the user
+    follows publishes, instead of the user reloading the followed tab.
+    Needs a threaded (or async) server, each client holds a worker thread,
+    so past RAGTIME_SSE_MAX_CLIENTS streams per process new ones get a
+    204, which tells EventSource to stop trying; the page still works.
+    """
+    if broadcaster.connected >= current_app.config['RAGTIME_SSE_MAX_CLIENTS']:
+        return '', 204
+    user_id = current_user.id
+    following = [f.following_id for f in current_user.following]
+    keepalive = current_app.config['RAGTIME_SSE_KEEPALIVE']
+    # Don't hold a database connection for as long as the client listens
+    db.session.remove()
+
+    def events():
+        with broadcaster.subscribe(user_id, following) as subscription:
+            yield f'retry: {keepalive * 1000}\n\n'
+            while not subscription.overflowed:
+                event = subscription.get(timeout=keepalive)
+                if event is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield format_event(event, event='composition')
+            # Missed some, the page has to catch up by itself
+            yield format_event({}, event='reload')
+    return current_app.response_class(stream_with_context(events()),
+                                      mimetype='text/event-stream',
+                                      headers={'Cache-Control': 'no-cache',
+                                               'X-Accel-Buffering': 'no'})
+
+
 @main.route('/moderate')
 @login_required
 @permission_required(Permission.MODERATE)
 @log_visit
 def moderate():
     page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page,
-        per_page=current_app.config['RAGTIME_COMMENTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(queries.comments(),
+                          (Comment.timestamp, Comment.id),
+                          per_page=current_app.config['RAGTIME_COMMENTS_PER_PAGE'])
     comments = pagination.items
     return render_template('moderate.html',
                            comments=comments,
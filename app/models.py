@@ -1,17 +1,72 @@
-import bleach
 import hashlib
+import json
 import re
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
-from flask import current_app, url_for
+from flask import current_app
 from flask_login import UserMixin, AnonymousUserMixin
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as WebSerializer
 from . import exceptions
+from . import rendering
+from .cache import LRUCache
 from . import db
 from . import login_manager
+from . import last_seen_tracker
+from . import principal_cache
+from . import fragment_cache
+from . import page_cache
+from . import broadcaster
+from . import job_runner
+from .serialization import api_url
 from .exceptions import ValidationError
 
 
+def adjust_counter(connection, target, column, id, delta):
+    """
+    Add delta to a denormalized counter column with a single UPDATE on the
+    flush's connection, then mirror it onto the row's instance if it's
+    already loaded, so nobody has to re-query to see the new count.
+    """
+    model = column.class_
+    connection.execute(model.__table__.update()
+                       .where(model.id == id)
+                       .values({column.key: column + delta}))
+    session = db.object_session(target)
+    if session is None:
+        return
+    instance = session.identity_map.get(identity_key(model, id))
+    if instance is not None and instance.__dict__.get(column.key) is not None:
+        set_committed_value(instance, column.key,
+                            instance.__dict__[column.key] + delta)
+
+
+def row_work_deferred(target):
+    """
+    Whether target's session is inserting in bulk (see deferred_row_work),
+    so its after_insert work is left for on_inserted_many().
+    """
+    session = db.object_session(target)
+    return session is not None and session.info.get('defer_row_work', False)
+
+
+@contextmanager
+def deferred_row_work(session):
+    """
+    Flush inside this block to skip the per-row after_insert work of
+    compositions and comments; then call their on_inserted_many() with
+    what was flushed, before committing.
+    """
+    session.info['defer_row_work'] = True
+    try:
+        yield
+    finally:
+        session.info.pop('defer_row_work', None)
+
+
 class Permission:
     """
     Permission model for defining permissions of the app
@@ -61,20 +116,24 @@ class Role(db.Model):
                                  Permission.MODERATE, Permission.ADMIN],
         }
         default_role = 'User'
+        # One query for the roles we have, then the flush inserts the
+        # missing ones and updates only those whose values changed, so
+        # running this again is a single SELECT. Going through the ORM
+        # keeps Role.on_updated pushing new permissions down to users.
+        existing = {role.name: role for role in
+                    Role.query.filter(Role.name.in_(list(roles)))}
         for r in roles:
-            # see if role is already in table
-            role = Role.query.filter_by(name=r).first()
+            role = existing.get(r)
             if role is None:
                 # it's not so make a new one
                 role = Role(name=r)
+                db.session.add(role)
             role.reset_permissions()
             # add whichever permissions the role needs
             for perm in roles[r]:
                 role.add_permission(perm)
             # if role is the default one, default is True
             role.default = (role.name == default_role)
-            # add new role
-            db.session.add(role)
         db.session.commit()
 
     def __repr__(self):
@@ -95,6 +154,19 @@ class Role(db.Model):
         # Use bitwise AND to see if perm present
         return self.permissions & perm == perm
 
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        # Push new permissions down to the copy every user row carries
+        if not db.inspect(target).attrs.permissions.history.has_changes():
+            return
+        connection.execute(User.__table__.update()
+                           .where(User.role_id == target.id)
+                           .values(permissions=target.permissions))
+        session = db.object_session(target)
+        for user in list(session.identity_map.values()) if session else ():
+            if isinstance(user, User) and user.role_id == target.id:
+                set_committed_value(user, 'permissions', target.permissions)
+
 
 class Follow(db.Model):
     __tablename__ = 'follows'
@@ -106,6 +178,73 @@ class Follow(db.Model):
                              db.ForeignKey('users.id'),
                              primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Followers/following lists are paginated by (timestamp, other id)
+    __table_args__ = (
+        db.Index('ix_follows_following_timestamp', 'following_id', 'timestamp'),
+        db.Index('ix_follows_follower_timestamp', 'follower_id', 'timestamp'),
+    )
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        adjust_counter(connection, target, User.following_count, target.follower_id, 1)
+        adjust_counter(connection, target, User.follower_count, target.following_id, 1)
+        # Back-fill the follower's timeline with what they can now see
+        connection.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'composition_id', 'artist_id', 'timestamp'],
+            db.select([db.literal(target.follower_id),
+                       Composition.id,
+                       Composition.artist_id,
+                       Composition.timestamp])
+            .where(Composition.artist_id == target.following_id)))
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        adjust_counter(connection, target, User.following_count, target.follower_id, -1)
+        adjust_counter(connection, target, User.follower_count, target.following_id, -1)
+        # Prune everything the unfollowed artist put on the timeline
+        connection.execute(TimelineEntry.__table__.delete().where(db.and_(
+            TimelineEntry.user_id == target.follower_id,
+            TimelineEntry.artist_id == target.following_id)))
+
+
+db.event.listen(Follow, 'after_insert', Follow.on_inserted)
+db.event.listen(Follow, 'after_delete', Follow.on_deleted)
+
+
+class TimelineEntry(db.Model):
+    """
+    Materialized timeline: one row per (follower, composition they can see).
+    Filled on write so reading a page of followed compositions is a range
+    scan over (user_id, timestamp) instead of a join over follows.
+    """
+    __tablename__ = 'timeline_entries'
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('users.id'),
+                        primary_key=True)
+    composition_id = db.Column(db.Integer,
+                               db.ForeignKey('compositions.id'),
+                               primary_key=True)
+    # Denormalized so unfollow can prune without touching compositions
+    artist_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    timestamp = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_timeline_entries_user_artist', 'user_id', 'artist_id'),
+    )
+
+    @staticmethod
+    def rebuild():
+        """Throw away every timeline and recompute them from follows"""
+        db.session.execute(TimelineEntry.__table__.delete())
+        db.session.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'composition_id', 'artist_id', 'timestamp'],
+            db.select([Follow.follower_id,
+                       Composition.id,
+                       Composition.artist_id,
+                       Composition.timestamp])
+            .where(Follow.following_id == Composition.artist_id)))
+        Change.log_reset('timeline')
+        db.session.commit()
 
 
 class User(UserMixin, db.Model):
@@ -113,6 +252,9 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, index=True)
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
+    # Copy of role.permissions so checking one is a single AND, no role
+    # load. Kept in step by the User.role and Role update events.
+    permissions = db.Column(db.Integer, default=0, nullable=False)
     email = db.Column(db.String(64), unique=True, index=True)
     password_hash = db.Column(db.String(128))
     confirmed = db.Column(db.Boolean, default=False)
@@ -122,6 +264,11 @@ class User(UserMixin, db.Model):
     bio = db.Column(db.Text())
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
     avatar_hash = db.Column(db.String(32))
+    # Denormalized counts, kept in step by the Composition and Follow
+    # insert/delete events (self-follows included, like the relationships)
+    composition_count = db.Column(db.Integer, default=0, nullable=False)
+    follower_count = db.Column(db.Integer, default=0, nullable=False)
+    following_count = db.Column(db.Integer, default=0, nullable=False)
     compositions = db.relationship('Composition', backref='artist', lazy='dynamic')
     # Followers and Following
     # NOTE: I'm *following* someone as a *follower*
@@ -162,11 +309,45 @@ class User(UserMixin, db.Model):
 
     @staticmethod
     def add_self_follows():
-        for user in User.query.all():
-            if not user.is_following(user):
-                user.follow(user)
-                db.session.add(user)
-                db.session.commit()
+        """
+        Make every user who doesn't follow themselves do so, the same few
+        statements whatever the number of users, and nothing once done.
+        What the Follow events do per row (counters, change log,
+        timelines) is done here for the whole set. Returns how many
+        follows were added.
+        """
+        now = db.literal(datetime.utcnow(), db.DateTime)
+        missing = ~db.exists().where(db.and_(Follow.follower_id == User.id,
+                                             Follow.following_id == User.id))
+        id = db.cast(User.id, db.String)
+        key = '{"follower_id": ' + id + ', "following_id": ' + id + '}'
+        lock_change_log(db.session.connection())
+        db.session.execute(Change.__table__.insert().from_select(
+            ['kind', 'op', 'key', 'timestamp'],
+            db.select([db.literal(Change.KINDS[Follow]), db.literal('created'),
+                       key, now])
+            .where(missing)))
+        db.session.execute(User.__table__.update()
+                           .where(missing)
+                           .values(follower_count=User.follower_count + 1,
+                                   following_count=User.following_count + 1))
+        added = db.session.execute(Follow.__table__.insert().from_select(
+            ['follower_id', 'following_id', 'timestamp'],
+            db.select([User.id.label('follower_id'), User.id.label('following_id'), now])
+            .where(missing))).rowcount
+        # Their own compositions, on timelines that lack them
+        listed = db.exists().where(db.and_(
+            TimelineEntry.user_id == Composition.artist_id,
+            TimelineEntry.composition_id == Composition.id))
+        db.session.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'composition_id', 'artist_id', 'timestamp'],
+            db.select([Composition.artist_id.label('user_id'),
+                       Composition.id,
+                       Composition.artist_id,
+                       Composition.timestamp])
+            .where(db.and_(Composition.artist_id.isnot(None), ~listed))))
+        db.session.commit()
+        return added
 
     @property
     def password(self):
@@ -199,16 +380,35 @@ class User(UserMixin, db.Model):
 
     # Simple check for if a user can do something
     def can(self, perm):
-        return self.role is not None and self.role.has_permission(perm)
+        return self.permissions is not None and self.permissions & perm == perm
+
+    @staticmethod
+    def on_changed_role(target, value, oldvalue, initiator):
+        target.permissions = value.permissions if value is not None else 0
+
+    @staticmethod
+    def sync_permissions():
+        """
+        Recopy every user's permissions from their role in one UPDATE,
+        touching only the rows that are out of step. Returns their number.
+        """
+        permissions = db.func.coalesce(
+            db.select([Role.permissions])
+            .where(Role.id == User.role_id)
+            .as_scalar(), 0)
+        count = db.session.execute(User.__table__.update()
+                                   .where(User.permissions != permissions)
+                                   .values(permissions=permissions)).rowcount
+        db.session.commit()
+        return count
 
     # Because it's very common to check for admin
     def is_administrator(self):
         return self.can(Permission.ADMIN)
 
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
-        db.session.commit()
+        # Buffered and written in batches, see LastSeenTracker
+        last_seen_tracker.touch(self)
 
     # We use this to prevent
     def email_hash(self):
@@ -243,9 +443,16 @@ class User(UserMixin, db.Model):
 
     @property
     def followed_compositions(self):
-        return Composition.query.join(Follow, Follow.following_id == Composition.artist_id)\
-            .filter(Follow.follower_id == self.id)
+        # Already ordered newest first, straight off the timeline index
+        return Composition.query.join(TimelineEntry,
+                                      TimelineEntry.composition_id == Composition.id)\
+            .filter(TimelineEntry.user_id == self.id)\
+            .order_by(TimelineEntry.timestamp.desc())
 
+    @property
+    def page_tags(self):
+        # What cached pages showing this user depend on, see PageCache
+        return {('user', self.id)}
 
     def generate_auth_token(self, expiration_sec):
         s = WebSerializer(current_app.config['SECRET_KEY'],
@@ -255,22 +462,37 @@ class User(UserMixin, db.Model):
 
     @staticmethod
     def verify_auth_token(token):
-        s = WebSerializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
-            return None
-        return User.query.get(data['id'])
+        user_id = principal_cache.user_id_for_token(token)
+        if user_id is None:
+            s = WebSerializer(current_app.config['SECRET_KEY'])
+            try:
+                data, header = s.loads(token, return_header=True)
+            except:
+                return None
+            user_id = data['id']
+            principal_cache.remember_token(token, user_id, header['exp'])
+        return principal_cache.load_user(user_id)
+
+    @staticmethod
+    def on_changed(mapper, connection, target):
+        # Their name and avatar are in the fragments of everything they made
+        fragment_cache.forget_artist(target.id)
+        # Evict now, and again once committed in case someone re-cached
+        # the old row in between
+        principal_cache.forget_user(target.id)
+        session = db.object_session(target)
+        if session is not None:
+            session.info.setdefault('stale_principals', set()).add(target.id)
 
     # Not identical to actual User model
     def to_json(self):
         json_user = {
-            'url': url_for('api.get_user', id=self.id),
+            'url': api_url('api.get_user', self.id),
             'username': self.username,
             'last_seen': self.last_seen,
-            'compositions_url': url_for('api.get_user_compositions', id=self.id),
-            'followed_compositions_url': url_for('api.get_user_followed', id=self.id),
-            'composition_count': self.compositions.count()
+            'compositions_url': api_url('api.get_user_compositions', self.id),
+            'followed_compositions_url': api_url('api.get_user_followed', self.id),
+            'composition_count': self.composition_count
         }
         return json_user
 
@@ -283,6 +505,13 @@ class AnonymousUser(AnonymousUserMixin):
         return False
 
 
+# The id every generated slug starts with
+SLUG_ID_RE = re.compile(r'(\d{1,10})-')
+# Slugs that don't lead to their composition by that id (old ones of a
+# renamed composition, hand-made ones) -> the composition's id
+_slug_ids = LRUCache(maxsize=4096, ttl=3600)
+
+
 class Composition(db.Model):
     """What our database holds"""
     __tablename__ = 'compositions'
@@ -292,10 +521,16 @@ class Composition(db.Model):
     title = db.Column(db.String(64))
     description = db.Column(db.Text)
     description_html = db.Column(db.Text)
+    # rendering.VERSION that produced description_html
+    html_version = db.Column(db.Integer)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     artist_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    # TODO: what if we have a duplicate?
+    # Set by on_inserted and on_changed_title. The id prefix keeps it
+    # unique however many compositions share a title.
     slug = db.Column(db.String(128), unique=True)
+    # Denormalized, kept in step by the Comment insert/delete events
+    comment_count = db.Column(db.Integer, default=0, nullable=False)
     comments = db.relationship('Comment', backref='composition', lazy='dynamic')
 
     def __init__(self, **kwargs):
@@ -304,32 +539,92 @@ class Composition(db.Model):
 
     @staticmethod
     def on_changed_description(target, value, oldvalue, initiator):
-        allowed_tags = ['a']
-        regex_str = r"@(\b[\w.]*\b)"
-        matches = re.findall(regex_str, value, flags=re.M|re.I)
-        for username in matches:
-            # TODO some complicated regex stuff I need to explain
-            user_link = url_for('main.user', username=username, _external=True)
-            value = value.replace(f"@{username}", f'<a href="{user_link}">@{username}</a>')
-        html = bleach.linkify(bleach.clean(value, tags=allowed_tags, strip=True))
-        target.description_html = html
-
-    def generate_slug(self):
-        self.slug = f"{self.id}-" + re.sub(r'[^\w]+', '-', self.title.lower())
-        db.session.add(self)
+        # Nothing to do if the text didn't actually change
+        if value == oldvalue and target.description_html is not None:
+            return
+        target.description_html = rendering.render_description(value)
+        target.html_version = rendering.VERSION
+
+    @property
+    def page_tags(self):
+        return {('composition', self.id), ('user', self.artist_id)}
+
+    @staticmethod
+    def slugify(id, title):
+        return f"{id}-" + re.sub(r'[^\w]+', '-', title.lower())
+
+    @staticmethod
+    def from_slug(slug):
+        """
+        The composition at slug, or None. Slugs start with the id, so
+        this is usually a primary key get(), answered from the identity
+        map if the composition is already loaded. If the slug isn't the
+        composition's current one (the title changed since), it is still
+        found: compare .slug to redirect. Only slugs without a usable id
+        go through the slug index, once, and are remembered.
+        """
+        id = _slug_ids.get(slug)
+        if id is not None:
+            composition = Composition.query.get(id)
+            if composition is not None:
+                return composition
+        match = SLUG_ID_RE.match(slug)
+        composition = None
+        if match is not None and int(match.group(1)) < 2 ** 31:
+            composition = Composition.query.get(int(match.group(1)))
+            if composition is not None and composition.slug == slug:
+                return composition
+        # A stale slug of that composition, unless another one has it
+        composition = Composition.query.filter_by(slug=slug).first() or composition
+        if composition is not None:
+            _slug_ids.set(slug, composition.id)
+        return composition
+
+    @staticmethod
+    def on_changed_title(target, value, oldvalue, initiator):
+        # Checked here, before the slug is made from it, whoever sets it
+        if value is not None and not isinstance(value, str):
+            raise ValidationError("Composition title must be a string")
+        # New compositions have no id yet, on_inserted slugs those
+        if target.id is not None and value is not None:
+            target.slug = Composition.slugify(target.id, value)
+
+    @staticmethod
+    def fill_slugs(regenerate=False):
+        """
+        Slug every composition missing one, or all of them if regenerate,
+        with a single UPDATE. Returns how many rows were written.
+        """
+        table = Composition.__table__
+        connection = db.session.connection()
+        if connection.dialect.name == 'postgresql':
+            slug = db.cast(table.c.id, db.Text) + '-' + db.func.regexp_replace(
+                db.func.lower(table.c.title), r'[^\w]+', '-', 'g')
+        else:
+            # SQLite has no regexp_replace, so lend it slugify itself
+            connection.connection.create_function(
+                'slugify', 2, Composition.slugify, deterministic=True)
+            slug = db.func.slugify(table.c.id, table.c.title)
+        update = table.update()\
+            .where(table.c.title.isnot(None))\
+            .values(slug=slug, updated_at=table.c.updated_at)
+        if not regenerate:
+            update = update.where(table.c.slug.is_(None))
+        count = db.session.execute(update).rowcount
         db.session.commit()
+        return count
 
     def to_json(self):
         json_composition = {
-            'url': url_for('api.get_composition', id=self.id),
+            'url': api_url('api.get_composition', self.id),
             'release_type': self.release_type,
             'title': self.title,
             'description': self.description,
             'description_html': self.description_html,
             'timestamp': self.timestamp,
-            'artist_url': url_for('api.get_user', id=self.artist_id),
-            'comments_url': url_for('api.get_composition_comments', id=self.id),
-            'comment_count': self.comments.count()
+            'artist_url': api_url('api.get_user', self.artist_id),
+            'comments_url': api_url('api.get_composition_comments', self.id),
+            'comment_count': self.comment_count
         }
         return json_composition
 
@@ -345,12 +640,68 @@ class Composition(db.Model):
             raise ValidationError("Composition must have a title")
         if description is None:
             raise ValidationError("Composition must have a description")
+        if not isinstance(release_type, int) or isinstance(release_type, bool):
+            raise ValidationError("Composition release type must be an integer")
+        if not isinstance(title, str) or not isinstance(description, str):
+            raise ValidationError("Composition title and description must be strings")
         return Composition(release_type=release_type,
                            title=title,
                            description=description)
 
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        if row_work_deferred(target):
+            return
+        Composition.on_inserted_many(connection, [target])
+
+    @staticmethod
+    def on_inserted_many(connection, compositions):
+        """
+        What follows the INSERT of new compositions, in the same
+        transaction: their slugs (which need the id) in one executemany,
+        one counter UPDATE per artist and one timeline fan-out to
+        everyone following them.
+        """
+        table = Composition.__table__
+        slugs = {c: Composition.slugify(c.id, c.title) for c in compositions
+                 if c.slug is None and c.title is not None}
+        if slugs:
+            # leaving updated_at as the INSERT set it
+            connection.execute(table.update()
+                               .where(table.c.id == db.bindparam('_id'))
+                               .values(slug=db.bindparam('_slug'),
+                                       updated_at=table.c.updated_at),
+                               [{'_id': c.id, '_slug': slug} for c, slug in slugs.items()])
+            for c, slug in slugs.items():
+                set_committed_value(c, 'slug', slug)
+        for artist_id, count in Counter(c.artist_id for c in compositions).items():
+            adjust_counter(connection, compositions[0], User.composition_count,
+                           artist_id, count)
+        connection.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'composition_id', 'artist_id', 'timestamp'],
+            db.select([Follow.follower_id,
+                       Composition.id,
+                       Composition.artist_id,
+                       Composition.timestamp])
+            .where(db.and_(Composition.id.in_([c.id for c in compositions]),
+                           Follow.following_id == Composition.artist_id))))
+
+    @staticmethod
+    def on_deleting(mapper, connection, target):
+        # Timeline rows reference the composition, so they go first
+        connection.execute(TimelineEntry.__table__.delete().where(
+            TimelineEntry.composition_id == target.id))
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        adjust_counter(connection, target, User.composition_count, target.artist_id, -1)
+
 
 db.event.listen(Composition.description, 'set', Composition.on_changed_description)
+db.event.listen(Composition.title, 'set', Composition.on_changed_title)
+db.event.listen(Composition, 'after_insert', Composition.on_inserted)
+db.event.listen(Composition, 'before_delete', Composition.on_deleting)
+db.event.listen(Composition, 'after_delete', Composition.on_deleted)
 
 
 class Comment(db.Model):
@@ -358,26 +709,56 @@ class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
+    # rendering.VERSION that produced body_html
+    html_version = db.Column(db.Integer)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     disabled = db.Column(db.Boolean, default=False)
     # TODO change to user?
     artist_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     composition_id = db.Column(db.Integer, db.ForeignKey('compositions.id'))
+    # A composition's comments are paginated by (timestamp, id)
+    __table_args__ = (
+        db.Index('ix_comments_composition_timestamp', 'composition_id', 'timestamp'),
+    )
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a']
-        target.body_html = bleach.linkify(bleach.clean(
-            value, tags=allowed_tags, strip=True))
+        if value == oldvalue and target.body_html is not None:
+            return
+        target.body_html = rendering.render_comment(value)
+        target.html_version = rendering.VERSION
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        if row_work_deferred(target):
+            return
+        Comment.on_inserted_many(connection, [target])
+
+    @staticmethod
+    def on_inserted_many(connection, comments):
+        """One comment_count UPDATE per composition commented on"""
+        for composition_id, count in Counter(c.composition_id for c in comments).items():
+            adjust_counter(connection, comments[0], Composition.comment_count,
+                           composition_id, count)
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        adjust_counter(connection, target, Composition.comment_count, target.composition_id, -1)
+
+    @property
+    def page_tags(self):
+        # Comments are shown on their composition's page
+        return {('composition', self.composition_id), ('user', self.artist_id)}
 
     def to_json(self):
         json_comment = {
-            'url': url_for('api.get_comment', id=self.id),
-            'composition_url': url_for('api.get_composition', id=self.composition_id),
+            'url': api_url('api.get_comment', self.id),
+            'composition_url': api_url('api.get_composition', self.composition_id),
             'body': self.body,
             'body_html': self.body_html,
             'timestamp': self.timestamp,
-            'artist_url': url_for('api.get_user', id=self.artist_id),
+            'artist_url': api_url('api.get_user', self.artist_id),
         }
         return json_comment
 
@@ -387,13 +768,304 @@ class Comment(db.Model):
         body = json_comment.get('body')
         if body is None or body == "":
             raise ValidationError("Comment must have a body")
+        if not isinstance(body, str):
+            raise ValidationError("Comment body must be a string")
         return Comment(body=body)
 
 
 db.event.listen(Comment.body, 'set', Comment.on_changed_body)
+db.event.listen(Comment, 'after_insert', Comment.on_inserted)
+db.event.listen(Comment, 'after_delete', Comment.on_deleted)
+
+
+def reconcile_counters():
+    """
+    Recount every denormalized counter from scratch, one correlated UPDATE
+    per table. Use after migrations, bulk loads or anything else that went
+    around the ORM events.
+    """
+    def count(column, where):
+        return db.select([db.func.count()]).select_from(column.table)\
+            .where(where).as_scalar()
+
+    db.session.execute(User.__table__.update().values(
+        composition_count=count(Composition.id, Composition.artist_id == User.id),
+        follower_count=count(Follow.follower_id, Follow.following_id == User.id),
+        following_count=count(Follow.following_id, Follow.follower_id == User.id)))
+    db.session.execute(Composition.__table__.update().values(
+        comment_count=count(Comment.id, Comment.composition_id == Composition.id)))
+    # Compositions show their comment count, and either can embed their
+    # artist with theirs
+    Change.log_reset('composition', 'comment')
+    db.session.commit()
 
 login_manager.anonymous_user = AnonymousUser
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return principal_cache.load_user(int(user_id))
+
+
+def forget_stale_principals(session):
+    for user_id in session.info.pop('stale_principals', ()):
+        principal_cache.forget_user(user_id)
+
+
+def forget_all_principals(mapper, connection, target):
+    # Roles change rarely, and any of their users may be cached
+    principal_cache.users.clear()
+
+
+# User.role is a backref, it only exists once the mappers are configured
+db.configure_mappers()
+db.event.listen(User.role, 'set', User.on_changed_role)
+db.event.listen(Role, 'after_update', Role.on_updated)
+db.event.listen(User, 'after_update', User.on_changed)
+db.event.listen(User, 'after_delete', User.on_changed)
+db.event.listen(Role, 'after_update', forget_all_principals)
+db.event.listen(Role, 'after_delete', forget_all_principals)
+db.event.listen(db.session, 'after_commit', forget_stale_principals)
+
+
+def forget_fragment(mapper, connection, target):
+    fragment_cache.forget(target.__tablename__[:-1], target.id)
+
+
+for model in (Composition, Comment):
+    db.event.listen(model, 'after_update', forget_fragment)
+    db.event.listen(model, 'after_delete', forget_fragment)
+
+
+def invalidate_pages(session, tags):
+    # Now, and again once committed in case a page was rendered from the
+    # old rows in between
+    page_cache.invalidate(*tags)
+    if session is not None:
+        session.info.setdefault('stale_pages', set()).update(tags)
+
+
+def on_changed_page(mapper, connection, target):
+    invalidate_pages(db.object_session(target), target.page_tags)
+
+
+def on_listed_page(mapper, connection, target):
+    # New and deleted compositions also move every listing of them
+    invalidate_pages(db.object_session(target),
+                     target.page_tags | {'compositions'})
+
+
+def on_followed_page(mapper, connection, target):
+    # Both profiles show follower counts
+    invalidate_pages(db.object_session(target),
+                     {('user', target.follower_id), ('user', target.following_id)})
+
+
+def invalidate_stale_pages(session):
+    tags = session.info.pop('stale_pages', None)
+    if tags:
+        page_cache.invalidate(*tags)
+
+
+for model in (User, Composition, Comment):
+    db.event.listen(model, 'after_update', on_changed_page)
+db.event.listen(User, 'after_delete', on_changed_page)
+db.event.listen(Comment, 'after_insert', on_changed_page)
+db.event.listen(Comment, 'after_delete', on_changed_page)
+db.event.listen(Composition, 'after_insert', on_listed_page)
+db.event.listen(Composition, 'after_delete', on_listed_page)
+db.event.listen(Follow, 'after_insert', on_followed_page)
+db.event.listen(Follow, 'after_delete', on_followed_page)
+db.event.listen(db.session, 'after_commit', invalidate_stale_pages)
+
+
+def queue_broadcast(mapper, connection, target):
+    # Everything the event needs is read now: after the commit the
+    # instance is expired, and loading it again would start a transaction
+    artist = target.__dict__.get('artist')
+    event = {'id': target.id,
+             'title': target.title,
+             'artist_id': target.artist_id,
+             'artist': artist.username if artist is not None else None,
+             'timestamp': target.timestamp.isoformat() + 'Z'}
+    db.object_session(target).info.setdefault('broadcasts', []).append(
+        (broadcaster.publish, target.artist_id, event))
+
+
+def queue_follow(mapper, connection, target):
+    db.object_session(target).info.setdefault('broadcasts', []).append(
+        (broadcaster.follow, target.follower_id, target.following_id))
+
+
+def queue_unfollow(mapper, connection, target):
+    db.object_session(target).info.setdefault('broadcasts', []).append(
+        (broadcaster.unfollow, target.follower_id, target.following_id))
+
+
+def send_broadcasts(session):
+    # Only what was committed, in the order it happened
+    for call, *args in session.info.pop('broadcasts', ()):
+        call(*args)
+
+
+def drop_broadcasts(session):
+    session.info.pop('broadcasts', None)
+
+
+db.event.listen(Composition, 'after_insert', queue_broadcast)
+db.event.listen(Follow, 'after_insert', queue_follow)
+db.event.listen(Follow, 'after_delete', queue_unfollow)
+db.event.listen(db.session, 'after_commit', send_broadcasts)
+db.event.listen(db.session, 'after_rollback', drop_broadcasts)
+
+
+class Change(db.Model):
+    """
+    Append-only log of created, updated and deleted compositions, comments
+    and follows, written by log_changes() in the transaction that made
+    them. Ids increase in commit order, so a client that remembers the
+    last id it saw catches up with one range scan of the primary key.
+    Bulk writes that go around the ORM log one 'reset' per kind instead
+    (see log_reset()), meaning any row of that kind may have changed.
+    """
+    __tablename__ = 'changes'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16))
+    op = db.Column(db.String(8))
+    # The row's primary key as JSON: {"id": 7}, or follower_id and following_id
+    key = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # The last change of a kind is one probe of this index, see latest()
+    __table_args__ = (
+        db.Index('ix_changes_kind_id', 'kind', 'id'),
+    )
+
+    # What gets logged, under which kind
+    KINDS = {Composition: 'composition', Comment: 'comment', Follow: 'follow'}
+
+    @staticmethod
+    def latest(*kinds):
+        """
+        The id of the last change of each of kinds (None if there was
+        none), in one SELECT: a version counter for every collection
+        made of those rows.
+        """
+        return tuple(db.session.query(*[
+            db.select([db.func.max(Change.id)]).where(Change.kind == kind).as_scalar()
+            for kind in kinds]).one())
+
+    @staticmethod
+    def log_reset(*kinds):
+        """
+        Log that every row of each of kinds may have changed, in the
+        current transaction. For writers that bypass log_changes(), so
+        the collections built from those kinds get a new version.
+        """
+        now = datetime.utcnow()
+        lock_change_log(db.session.connection())
+        db.session.execute(Change.__table__.insert(),
+                           [{'kind': kind, 'op': 'reset', 'key': '{}', 'timestamp': now}
+                            for kind in kinds])
+
+    def to_json(self):
+        key = json.loads(self.key)
+        json_change = {
+            'id': self.id,
+            'type': self.kind,
+            'op': self.op,
+            'key': key,
+            'url': None,
+            'timestamp': self.timestamp,
+        }
+        if self.op in ('created', 'updated') and self.kind in ('composition', 'comment'):
+            json_change['url'] = api_url(f'api.get_{self.kind}', key['id'])
+        return json_change
+
+
+# Arbitrary but fixed id of the advisory lock serializing change log writers
+CHANGE_LOG_LOCK = 0x7261677469
+
+
+def lock_change_log(connection):
+    """Serialize change log writers until commit, on PostgreSQL"""
+    if connection.dialect.name == 'postgresql':
+        connection.execute(db.select([db.func.pg_advisory_xact_lock(CHANGE_LOG_LOCK)]))
+
+
+def log_changes(session, flush_context):
+    """
+    Turn what the flush just wrote into Change rows, inserted with one
+    executemany on the flush's connection. On PostgreSQL a transaction
+    advisory lock makes concurrent writers take change ids in the order
+    they commit, so readers never see a later id before an earlier one.
+    """
+    changes = []
+    now = datetime.utcnow()
+    for op, objects in (('created', session.new),
+                        ('updated', session.dirty),
+                        ('deleted', session.deleted)):
+        for obj in objects:
+            kind = Change.KINDS.get(type(obj))
+            if kind is None:
+                continue
+            if op == 'updated' and \
+                    not session.is_modified(obj, include_collections=False):
+                continue
+            key = {column.key: getattr(obj, column.key)
+                   for column in db.inspect(obj).mapper.primary_key}
+            changes.append({'kind': kind, 'op': op, 'timestamp': now,
+                            'key': json.dumps(key, sort_keys=True)})
+    if not changes:
+        return
+    connection = session.connection()
+    lock_change_log(connection)
+    connection.execute(Change.__table__.insert(), changes)
+
+
+db.event.listen(db.session, 'after_flush', log_changes)
+
+
+class Job(db.Model):
+    """
+    Durable follow-up work, written in the same transaction as whatever
+    asked for it and run afterwards by a JobRunner (see jobs.py), either
+    inside the web process or under `flask worker`.
+    """
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64))
+    # JSON keyword arguments for the handler
+    payload = db.Column(db.Text)
+    # Higher runs first
+    priority = db.Column(db.Integer, default=0)
+    # queued, running, done or failed
+    status = db.Column(db.String(8), default='queued')
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=5)
+    # Not before this; while running, when the claim expires
+    run_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Enqueueing the same key twice only creates one job
+    key = db.Column(db.String(128), unique=True)
+    # Site root of the request that enqueued it, for url_for(_external=True)
+    base_url = db.Column(db.String(256))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.name} {self.status}>"
+
+
+def wake_job_runner(session):
+    if session.info.pop('jobs_enqueued', False):
+        job_runner.wake()
+
+
+def forget_enqueued_jobs(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+db.event.listen(db.session, 'after_commit', wake_job_runner)
+db.event.listen(db.session, 'after_rollback', forget_enqueued_jobs)
@@ -0,0 +1,155 @@
+import atexit
+import os
+import smtplib
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from time import sleep
+
+
+class Outbox:
+    """
+    Delivers mail from a fixed pool of worker threads fed by a bounded
+    queue, instead of one thread and one SMTP connection per message.
+
+    A worker takes whatever is waiting, up to RAGTIME_MAIL_BATCH_SIZE
+    messages, and sends them all over a single mail.connect() connection.
+    If the server or the connection fails, the unsent rest of the batch
+    is retried on a new connection after RAGTIME_MAIL_RETRY_BACKOFF
+    seconds, doubling each time, up to RAGTIME_MAIL_RETRIES times. When
+    the queue is full, send() waits up to RAGTIME_MAIL_ENQUEUE_TIMEOUT
+    seconds for room and then drops the message, so a burst of signups
+    can't pile up threads or memory. stats() reports the queue depth and
+    what happened to everything sent so far.
+
+    Workers start with the first message, once per process, and are
+    drained at exit.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._workers = []
+        self._pid = None
+        self._lock = Lock()
+        self._counts = {'sent': 0, 'failed': 0, 'retried': 0, 'dropped': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RAGTIME_MAIL_WORKERS', 2)
+        app.config.setdefault('RAGTIME_MAIL_QUEUE_SIZE', 100)
+        app.config.setdefault('RAGTIME_MAIL_BATCH_SIZE', 20)
+        app.config.setdefault('RAGTIME_MAIL_RETRIES', 3)
+        app.config.setdefault('RAGTIME_MAIL_RETRY_BACKOFF', 1.0)
+        app.config.setdefault('RAGTIME_MAIL_ENQUEUE_TIMEOUT', 5.0)
+        self.app = app
+        atexit.register(self.shutdown)
+
+    def send(self, msg):
+        """Queue msg for delivery, False if it had to be dropped"""
+        self._start()
+        try:
+            self._queue.put(msg, timeout=self.app.config['RAGTIME_MAIL_ENQUEUE_TIMEOUT'])
+        except Full:
+            self._count('dropped')
+            self.app.logger.error(f'Mail queue full, dropped mail to {msg.recipients}')
+            return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        stats['queued'] = self._queue.qsize() if self._queue is not None else 0
+        stats['maxsize'] = self.app.config['RAGTIME_MAIL_QUEUE_SIZE']
+        stats['workers'] = sum(worker.is_alive() for worker in self._workers)
+        return stats
+
+    def join(self):
+        """Wait until everything queued so far was delivered or given up on"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def shutdown(self):
+        """Deliver what is queued, then stop the workers"""
+        with self._lock:
+            queue, workers = self._queue, self._workers
+            self._queue, self._workers, self._pid = None, [], None
+        if queue is None:
+            return
+        for _ in workers:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+
+    def _start(self):
+        with self._lock:
+            # A forked worker process gets its own threads and queue
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = Queue(self.app.config['RAGTIME_MAIL_QUEUE_SIZE'])
+            self._workers = [Thread(target=self._work, args=(self._queue,),
+                                    name=f'outbox-{i}', daemon=True)
+                             for i in range(self.app.config['RAGTIME_MAIL_WORKERS'])]
+            for worker in self._workers:
+                worker.start()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counts[name] += n
+
+    def _work(self, queue):
+        while True:
+            batch = [queue.get()]
+            while batch[-1] is not None and \
+                    len(batch) < self.app.config['RAGTIME_MAIL_BATCH_SIZE']:
+                try:
+                    batch.append(queue.get_nowait())
+                except Empty:
+                    break
+            stop = batch[-1] is None
+            messages = [msg for msg in batch if msg is not None]
+            try:
+                if messages:
+                    with self.app.app_context():
+                        self._deliver(messages)
+            except Exception:
+                # Never lose the worker to one bad batch
+                self._count('failed', len(messages))
+                self.app.logger.exception(f'Could not deliver {len(messages)} mails')
+            finally:
+                for _ in batch:
+                    queue.task_done()
+            if stop:
+                return
+
+    def _deliver(self, messages):
+        from . import mail
+        retries = self.app.config['RAGTIME_MAIL_RETRIES']
+        delay = self.app.config['RAGTIME_MAIL_RETRY_BACKOFF']
+        attempt = 0
+        while messages:
+            try:
+                with mail.connect() as connection:
+                    while messages:
+                        msg = messages.pop(0)
+                        try:
+                            connection.send(msg)
+                        except smtplib.SMTPRecipientsRefused:
+                            # This one will never go through, the rest might
+                            self._count('failed')
+                            self.app.logger.error(f'Mail to {msg.recipients} refused')
+                            continue
+                        except BaseException:
+                            messages.insert(0, msg)
+                            raise
+                        self._count('sent')
+            except (smtplib.SMTPException, OSError):
+                if attempt >= retries:
+                    self._count('failed', len(messages))
+                    self.app.logger.exception(f'Gave up on {len(messages)} mails')
+                    return
+                attempt += 1
+                self._count('retried')
+                sleep(delay)
+                delay *= 2
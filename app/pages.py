@@ -0,0 +1,151 @@
+import hashlib
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from itertools import count
+from threading import Lock
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+from .cache import LRUCache
+
+Page = namedtuple('Page', 'body content_type etag last_modified tags generation')
+
+
+class PageCache:
+    """
+    Serves whole pages to logged-out visitors, who all get the same HTML.
+
+    Views opt in with @page_cache.cached and say what they showed with
+    page_cache.depends_on(composition, comment, user, ...), which turns
+    each object into tags like ('composition', 7) or ('user', 3) and keeps
+    the newest timestamp seen for Last-Modified. Cached pages are keyed by
+    path, query string and the RAGTIME_PAGE_CACHE_COOKIES cookies, and
+    carry an ETag of their body, so revalidation is answered with a 304
+    from memory whether or not the page was cached before.
+
+    Model listeners call invalidate() with the tags a write affects. Every
+    invalidation takes the next number off a global counter and records it
+    against its tags; a page is only served while none of its tags were
+    invalidated after it started rendering, which also catches writes that
+    land while the page is being rendered. Only the most recent
+    RAGTIME_PAGE_CACHE_TAGS tags are remembered; a tag that was forgotten
+    counts as invalidated when the last one was dropped, which at worst
+    re-renders an older page that was still fresh.
+    """
+
+    def __init__(self, app=None):
+        self.cache = LRUCache()
+        self._counter = count(1)
+        self._generation = 0
+        # tag -> generation, oldest invalidation first
+        self._invalidated = OrderedDict()
+        # no forgotten tag was invalidated after this
+        self._forgotten = 0
+        self._lock = Lock()
+        self.max_tags = 10000
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RAGTIME_PAGE_CACHE_SIZE', 512)
+        app.config.setdefault('RAGTIME_PAGE_CACHE_TTL', 300)
+        app.config.setdefault('RAGTIME_PAGE_CACHE_COOKIES', ())
+        app.config.setdefault('RAGTIME_PAGE_CACHE_TAGS', 10000)
+        self.max_tags = app.config['RAGTIME_PAGE_CACHE_TAGS']
+        self.cache.maxsize = app.config['RAGTIME_PAGE_CACHE_SIZE']
+        self.cache.ttl = app.config['RAGTIME_PAGE_CACHE_TTL']
+
+    def cached(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not self._cacheable():
+                return f(*args, **kwargs)
+            key = self._key()
+            page = self.cache.get(key)
+            if page is None or not self._fresh(page):
+                generation = self._generation
+                g.page_tags = set()
+                g.page_last_modified = None
+                response = make_response(f(*args, **kwargs))
+                if not self._storable(response):
+                    return response
+                body = response.get_data()
+                page = Page(body=body,
+                            content_type=response.content_type,
+                            etag=hashlib.sha1(body).hexdigest(),
+                            last_modified=g.page_last_modified,
+                            tags=frozenset(g.page_tags),
+                            generation=generation)
+                self.cache.set(key, page)
+            return self._respond(page)
+        return decorated_function
+
+    def depends_on(self, *objects):
+        """Record what the page being rendered shows"""
+        if 'page_tags' not in g:
+            return
+        for obj in objects:
+            g.page_tags.update(obj.page_tags)
+            changed = getattr(obj, 'updated_at', None) or \
+                getattr(obj, 'timestamp', None)
+            if changed is not None and (g.page_last_modified is None or
+                                        changed > g.page_last_modified):
+                g.page_last_modified = changed
+
+    def tag(self, *tags):
+        if 'page_tags' in g:
+            g.page_tags.update(tags)
+
+    def invalidate(self, *tags):
+        with self._lock:
+            generation = next(self._counter)
+            for tag in tags:
+                self._invalidated[tag] = generation
+                self._invalidated.move_to_end(tag)
+            while len(self._invalidated) > self.max_tags:
+                _, self._forgotten = self._invalidated.popitem(last=False)
+            self._generation = generation
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
+            # Pages still rendering started before now, and are stale
+            self._invalidated.clear()
+            self._forgotten = self._generation
+
+    def _fresh(self, page):
+        with self._lock:
+            return all(self._invalidated.get(tag, self._forgotten) <= page.generation
+                       for tag in page.tags)
+
+    @staticmethod
+    def _cacheable():
+        # Flashed messages are shown once, to one visitor
+        return request.method == 'GET' and \
+            not current_user.is_authenticated and \
+            '_flashes' not in session
+
+    @staticmethod
+    def _key():
+        cookies = tuple(request.cookies.get(name)
+                        for name in current_app.config['RAGTIME_PAGE_CACHE_COOKIES'])
+        return (request.path, request.query_string, cookies)
+
+    @staticmethod
+    def _storable(response):
+        # Anything that set a cookie or touched the session (a CSRF token,
+        # say) belongs to this visitor only
+        return response.status_code == 200 and \
+            not session.modified and \
+            'Set-Cookie' not in response.headers
+
+    @staticmethod
+    def _respond(page):
+        response = current_app.response_class(page.body,
+                                               content_type=page.content_type)
+        response.set_etag(page.etag)
+        if page.last_modified is not None:
+            response.last_modified = page.last_modified
+        # Revalidate every time, and keep logged-in pages apart in caches
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response.make_conditional(request)
@@ -0,0 +1,116 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from flask import request
+from . import db
+from .exceptions import ValidationError
+
+
+def encode_cursor(values, direction='next'):
+    """Turn key values into an opaque, url-safe string"""
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps({'k': values, 'd': direction}, separators=(',', ':'))
+    return urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _coerce(key, value):
+    """A cursor value as the Python type of its key column"""
+    if isinstance(key.type, db.DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(key.type, db.Integer):
+        # int() would take "1" and 1.5 too, neither of which we encoded
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise TypeError(value)
+        return value
+    if not isinstance(value, str):
+        raise TypeError(value)
+    return value
+
+
+def decode_cursor(cursor, keys):
+    """Inverse of encode_cursor(), coercing values back to the key types"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(urlsafe_b64decode(padded.encode('ascii')))
+        values = data['k']
+        direction = data['d']
+        if len(values) != len(keys) or direction not in ('next', 'prev'):
+            raise ValueError(cursor)
+        values = [_coerce(key, v) for key, v in zip(keys, values)]
+    except (ValueError, TypeError, KeyError):
+        raise ValidationError("Invalid cursor")
+    return values, direction
+
+
+class KeysetPagination:
+    """
+    Cursor pagination over an ordered set of key columns, usually
+    (timestamp, id). Each page is a range scan that starts right after the
+    last row of the previous one, so deep pages cost the same as the first
+    and no COUNT(*) is needed unless asked for.
+    """
+    is_keyset = True
+
+    def __init__(self, query, keys, cursor=None, per_page=20,
+                 descending=True, with_total=False):
+        self.per_page = per_page
+        self.cursor = cursor or None
+        self.total = query.order_by(None).count() if with_total else None
+
+        direction = 'next'
+        if self.cursor:
+            values, direction = decode_cursor(self.cursor, keys)
+        # Walking backwards is walking forwards in the opposite order
+        forwards = descending == (direction == 'next')
+        order = [key.desc() if forwards else key.asc() for key in keys]
+        query = query.order_by(None).order_by(*order).add_columns(*keys)
+        if self.cursor:
+            query = query.filter(self._after(keys, values, forwards))
+        rows = query.limit(per_page + 1).all()
+
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if direction == 'prev':
+            rows.reverse()
+            self.has_prev, self.has_next = more, True
+        else:
+            self.has_prev, self.has_next = self.cursor is not None, more
+        self.items = [row[0] for row in rows]
+        self.prev_cursor = None
+        self.next_cursor = None
+        if rows and self.has_prev:
+            self.prev_cursor = encode_cursor(rows[0][1:], 'prev')
+        if rows and self.has_next:
+            self.next_cursor = encode_cursor(rows[-1][1:], 'next')
+
+    @staticmethod
+    def _after(keys, values, descending):
+        """(k1, k2, ...) strictly past (v1, v2, ...) in the scan order"""
+        clauses = []
+        for i, (key, value) in enumerate(zip(keys, values)):
+            equal = [k == v for k, v in zip(keys[:i], values[:i])]
+            past = key < value if descending else key > value
+            clauses.append(db.and_(*equal, past))
+        return db.or_(*clauses)
+
+
+def paginate(query, keys, per_page, descending=True, page=None):
+    """
+    Paginate according to the request: ?cursor= selects keyset mode (an
+    empty cursor is the first page, ?count=1 adds the total), otherwise
+    the page-number mode we have always had.
+    """
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        return KeysetPagination(query, keys,
+                                cursor=cursor,
+                                per_page=per_page,
+                                descending=descending,
+                                with_total=request.args.get('count', 0, type=int) == 1)
+    order = [key.desc() if descending else key.asc() for key in keys]
+    if page is None:
+        page = request.args.get('page', 1, type=int)
+    return query.order_by(None).order_by(*order).paginate(
+        page,
+        per_page=per_page,
+        error_out=False)
@@ -0,0 +1,74 @@
+from time import time
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from .cache import LRUCache
+
+
+class PrincipalCache:
+    """
+    Remembers who the users behind session ids and API tokens are, so
+    authenticating a request doesn't have to hit the database.
+
+    Users are cached as a snapshot of their columns (id, confirmed,
+    permissions and the rest) and handed back as ordinary User instances
+    attached to the current session without a query. Tokens map to a user
+    id for as long as both the token and the cache ttl allow. Any change to
+    a User or Role row through the ORM evicts the affected entries; see the
+    listeners at the bottom of models.py.
+    """
+
+    def __init__(self, app=None):
+        self.users = LRUCache()
+        self.tokens = LRUCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RAGTIME_PRINCIPAL_CACHE_SIZE', 1024)
+        app.config.setdefault('RAGTIME_PRINCIPAL_CACHE_TTL', 60)
+        for cache in (self.users, self.tokens):
+            cache.maxsize = app.config['RAGTIME_PRINCIPAL_CACHE_SIZE']
+            cache.ttl = app.config['RAGTIME_PRINCIPAL_CACHE_TTL']
+
+    def load_user(self, user_id):
+        from . import db
+        from .models import User
+        # Whatever this session already has is at least as fresh
+        user = db.session.identity_map.get(identity_key(User, user_id))
+        if user is not None:
+            return user
+        snapshot = self.users.get(user_id)
+        if snapshot is None:
+            user = User.query.get(user_id)
+            if user is not None:
+                self.remember(user)
+            return user
+        user = User.__mapper__.class_manager.new_instance()
+        for key, value in snapshot.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        db.session.add(user)
+        return user
+
+    def remember(self, user):
+        columns = user.__mapper__.column_attrs
+        self.users.set(user.id, {c.key: getattr(user, c.key) for c in columns})
+
+    def user_id_for_token(self, token):
+        return self.tokens.get(token)
+
+    def remember_token(self, token, user_id, expires_at):
+        ttl = min(self.tokens.ttl, expires_at - time())
+        if ttl > 0:
+            self.tokens.set(token, user_id, ttl=ttl)
+
+    def forget_user(self, user_id):
+        self.users.pop(user_id)
+
+    def clear(self):
+        self.users.clear()
+        self.tokens.clear()
+
+    def stats(self):
+        return {'users': self.users.stats(), 'tokens': self.tokens.stats()}
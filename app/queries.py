@@ -0,0 +1,44 @@
+"""
+Query builders shared by the main and API views. Every list page touches
+each item's artist (username, avatar) and the follow lists touch the user
+on the other end, so load those up front with the page instead of lazily
+one row at a time.
+"""
+from sqlalchemy.orm import joinedload
+from .models import Composition, Comment, Follow
+
+
+def compositions(query=None):
+    """Compositions with their artist joined in"""
+    if query is None:
+        query = Composition.query
+    return query.options(joinedload(Composition.artist))
+
+
+def user_compositions(user):
+    return compositions(user.compositions)
+
+
+def followed_compositions(user):
+    return compositions(user.followed_compositions)
+
+
+def comments(query=None):
+    """Comments with their artist joined in"""
+    if query is None:
+        query = Comment.query
+    return query.options(joinedload(Comment.artist))
+
+
+def composition_comments(composition):
+    return comments(composition.comments)
+
+
+def followers(user):
+    """Follows pointing at user, with the follower joined in"""
+    return user.followers.options(joinedload(Follow.follower))
+
+
+def following(user):
+    """Follows made by user, with the followed user joined in"""
+    return user.following.options(joinedload(Follow.following))
@@ -0,0 +1,127 @@
+"""
+Turns user-written text into the HTML we store next to it.
+
+Descriptions get their @mentions linked to the artist's page, then
+everything is cleaned down to plain links and linkified. Mentions are
+found in one pass with a precompiled pattern and their links are made by
+filling in a URL template built with a single url_for(), not one route
+lookup and one str.replace() over the whole text per mention. Rendered
+output is cached by a hash of its input, so saving the same text twice
+(or two rows with identical text) renders once. Only short texts are:
+anything over MAX_CACHED_LENGTH characters, in or out, is rendered every
+time, so the cache holds at most 4096 entries of 8K characters each.
+
+Stored HTML is stamped with VERSION. Bump it whenever the output for the
+same input changes (allowed tags, mention links, ...) and run
+`flask rerender` to bring existing rows up to date.
+"""
+import hashlib
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import bleach
+from flask import url_for
+from werkzeug.urls import url_quote
+from .cache import LRUCache
+
+VERSION = 1
+ALLOWED_TAGS = ['a']
+MENTION_RE = re.compile(r"@(\b[\w.]*\b)", flags=re.M | re.I)
+_USERNAME = '__mention__'
+
+_cache = LRUCache(maxsize=4096)
+MAX_CACHED_LENGTH = 8 * 1024
+
+
+def mention_url_template():
+    """The external user page URL with a placeholder for the username"""
+    return url_for('main.user', username=_USERNAME, _external=True)
+
+
+def link_mentions(text, url_template):
+    def link(match):
+        username = match.group(1)
+        url = url_template.replace(_USERNAME, url_quote(username))
+        return f'<a href="{url}">@{username}</a>'
+    return MENTION_RE.sub(link, text)
+
+
+def clean(text):
+    return bleach.linkify(bleach.clean(text, tags=ALLOWED_TAGS, strip=True))
+
+
+def _cached(kind, text, render, *args):
+    if len(text) > MAX_CACHED_LENGTH:
+        return render(text, *args)
+    digest = hashlib.sha1('\0'.join((kind,) + args + (text,))
+                          .encode('utf-8')).hexdigest()
+    html = _cache.get(digest)
+    if html is None:
+        html = render(text, *args)
+        if len(html) <= MAX_CACHED_LENGTH:
+            _cache.set(digest, html)
+    return html
+
+
+def _render_description(text, url_template):
+    return clean(link_mentions(text, url_template))
+
+
+def render_description(text, url_template=None):
+    if url_template is None:
+        url_template = mention_url_template()
+    return _cached('description', text, _render_description, url_template)
+
+
+def render_comment(text):
+    return _cached('comment', text, clean)
+
+
+def rerender_stale(model, text_column, html_column, render,
+                   chunk_size=1000, workers=0):
+    """
+    Re-render every row of model whose html_version isn't VERSION,
+    chunk_size rows at a time, optionally spreading the rendering over a
+    pool of worker processes. Each chunk is read by walking the primary
+    key, written back with one executemany UPDATE and committed, so the
+    scan can be stopped and resumed at any point. Yields the number of rows
+    updated per chunk.
+    """
+    from . import db
+    pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+    stale = db.or_(model.html_version.is_(None), model.html_version != VERSION)
+    last_id = 0
+    try:
+        while True:
+            rows = db.session.query(model.id, text_column)\
+                .filter(stale, model.id > last_id)\
+                .order_by(model.id)\
+                .limit(chunk_size)\
+                .all()
+            if not rows:
+                break
+            texts = [text or '' for _, text in rows]
+            if pool is not None:
+                html = pool.map(render, texts,
+                                chunksize=max(1, len(texts) // (workers * 4)))
+            else:
+                html = map(render, texts)
+            db.session.bulk_update_mappings(model, [
+                {'id': id, html_column.key: value, 'html_version': VERSION}
+                for (id, _), value in zip(rows, html)])
+            db.session.commit()
+            last_id = rows[-1][0]
+            yield len(rows)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def rerender_descriptions(model, **kwargs):
+    render = partial(_render_description, url_template=mention_url_template())
+    return rerender_stale(model, model.description, model.description_html,
+                          render, **kwargs)
+
+
+def rerender_comments(model, **kwargs):
+    return rerender_stale(model, model.body, model.body_html, clean, **kwargs)
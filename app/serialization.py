@@ -0,0 +1,92 @@
+"""
+JSON for the API, faster than flask.jsonify() for big lists.
+
+jsonify() encodes with orjson when it is installed (and
+RAGTIME_JSON_BACKEND allows it) and falls back to Flask's own encoder
+otherwise. Both produce the same documents: keys sorted, datetimes as
+HTTP dates, anything else handed to app.json_encoder. orjson writes
+non-ASCII characters as UTF-8 rather than \\u escapes.
+
+api_url() builds the URL of an api.* endpoint taking a single id by
+formatting a template made with one url_for() per endpoint, instead of
+resolving the route for every item.
+"""
+from datetime import date
+from flask import _app_ctx_stack, _request_ctx_stack, current_app, json, url_for
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+_ID = 918273645
+
+
+def backend():
+    """'orjson' or 'stdlib', whichever jsonify() will use"""
+    choice = current_app.config.get('RAGTIME_JSON_BACKEND', 'auto')
+    if choice == 'stdlib' or orjson is None:
+        return 'stdlib'
+    return 'orjson'
+
+
+def _default(o):
+    if isinstance(o, date):
+        return http_date(o.timetuple())
+    return current_app.json_encoder().default(o)
+
+
+def dumps(obj, compact=False):
+    """
+    obj as JSON bytes, with a trailing newline like jsonify(). Indented
+    like jsonify() too, unless compact (one line, for NDJSON).
+    """
+    indent = not compact and \
+        (current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug)
+    if backend() == 'orjson':
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | \
+            orjson.OPT_APPEND_NEWLINE
+        if current_app.config['JSON_SORT_KEYS']:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_default, option=option)
+    if indent:
+        text = json.dumps(obj, indent=2, separators=(', ', ': '))
+    else:
+        text = json.dumps(obj, separators=(',', ':'))
+    return (text + '\n').encode('utf-8')
+
+
+def jsonify(*args, **kwargs):
+    """Drop-in for flask.jsonify()"""
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+    return current_app.response_class(dumps(data),
+                                      mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+def _url_template(endpoint):
+    # Templates live on the current request (or app) context, since
+    # url_for() output depends on its host and script root; one stack
+    # lookup here is most of what api_url() costs
+    ctx = _request_ctx_stack.top or _app_ctx_stack.top
+    templates = getattr(ctx, 'ragtime_url_templates', None)
+    if templates is None:
+        templates = ctx.ragtime_url_templates = {}
+    template = templates.get(endpoint)
+    if template is None:
+        prefix, suffix = url_for(endpoint, id=_ID).split(str(_ID))
+        template = templates[endpoint] = (prefix, suffix)
+    return template
+
+
+def api_url(endpoint, id):
+    """url_for(endpoint, id=id), for endpoints with only an int id"""
+    prefix, suffix = _url_template(endpoint)
+    return f'{prefix}{id}{suffix}'
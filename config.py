@@ -14,12 +14,74 @@ class Config():
     RAGTIME_ADMIN = os.environ.get('RAGTIME_ADMIN')
     RAGTIME_MAIL_SUBJECT_PREFIX = 'Ragtime —'
     RAGTIME_MAIL_SENDER = f'Ragtime Admin <{RAGTIME_ADMIN}>'
+    # Delivery pool, see Outbox
+    RAGTIME_MAIL_WORKERS = 2
+    RAGTIME_MAIL_QUEUE_SIZE = 100
+    RAGTIME_MAIL_BATCH_SIZE = 20
+    RAGTIME_MAIL_RETRIES = 3
+    RAGTIME_MAIL_RETRY_BACKOFF = 1.0
+    RAGTIME_MAIL_ENQUEUE_TIMEOUT = 5.0
 
     RAGTIME_COMPS_PER_PAGE = 20
     RAGTIME_FOLLOWERS_PER_PAGE = 20
     RAGTIME_FOLLOWING_PER_PAGE = 20
     RAGTIME_COMMENTS_PER_PAGE = 20
 
+    # last_seen is only bumped when older than this many seconds, and the
+    # pending bumps are written out at most once per flush interval
+    RAGTIME_LAST_SEEN_GRANULARITY = 60
+    RAGTIME_LAST_SEEN_FLUSH_INTERVAL = 10
+
+    # Users and API tokens remembered between requests, see PrincipalCache
+    RAGTIME_PRINCIPAL_CACHE_SIZE = 1024
+    RAGTIME_PRINCIPAL_CACHE_TTL = 60
+
+    # Verified Basic auth credentials, see CredentialCache (ttl 0 disables)
+    RAGTIME_CREDENTIAL_CACHE_SIZE = 1024
+    RAGTIME_CREDENTIAL_CACHE_TTL = 60
+    # Processes for password hashing, 0 hashes on the request thread
+    RAGTIME_PASSWORD_HASH_WORKERS = 2
+
+    # Rendered list items, see FragmentCache
+    RAGTIME_FRAGMENT_CACHE_SIZE = 4096
+    RAGTIME_FRAGMENT_CACHE_TTL = 300
+
+    # Whole pages for logged-out visitors, see PageCache
+    RAGTIME_PAGE_CACHE_SIZE = 512
+    RAGTIME_PAGE_CACHE_TTL = 300
+    RAGTIME_PAGE_CACHE_COOKIES = ()
+    # Invalidated tags remembered, see PageCache
+    RAGTIME_PAGE_CACHE_TAGS = 10000
+
+    # 'auto' uses orjson when it is installed, 'stdlib' never does
+    RAGTIME_JSON_BACKEND = 'auto'
+
+    # Rows fetched per round trip by the NDJSON exports
+    RAGTIME_EXPORT_CHUNK_SIZE = 1000
+
+    # Live timeline events: per client queue length, seconds between keepalives
+    RAGTIME_SSE_QUEUE_SIZE = 16
+    RAGTIME_SSE_KEEPALIVE = 15
+    # Each open stream holds a server thread: keep this below the threads
+    # per worker (--threads in the Procfile) so pages can still be served
+    RAGTIME_SSE_MAX_CLIENTS = int(os.environ.get('RAGTIME_SSE_MAX_CLIENTS') or 24)
+
+    # Background jobs, see jobs.py. Workers > 0 runs them in the web
+    # process too, 0 leaves them to `flask worker`
+    RAGTIME_JOB_WORKERS = 1
+    RAGTIME_JOB_POLL_INTERVAL = 5.0
+    RAGTIME_JOB_LEASE = 300
+    RAGTIME_JOB_MAX_ATTEMPTS = 5
+    RAGTIME_JOB_BACKOFF = 10
+    # Site root for links made outside of requests (jobs, CLI)
+    RAGTIME_BASE_URL = os.environ.get('RAGTIME_BASE_URL')
+
+    # Most compositions and comments one /api/v1/batch request may create
+    RAGTIME_BATCH_LIMIT = 1000
+
+    # Entries per /api/v1/changes response
+    RAGTIME_CHANGES_PER_PAGE = 100
+
     SSL_REDIRECT = False
 
     @staticmethod
@@ -50,6 +112,8 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_TEST_URL') or \
         'sqlite://'
     SERVER_NAME = 'localhost:5000'
+    RAGTIME_PASSWORD_HASH_WORKERS = 0
+    RAGTIME_JOB_WORKERS = 0
 
 
 class ProductionConfig(Config):
@@ -1,6 +1,9 @@
 import os
-from app import create_app, db, mail
-from app.models import User, Role, Permission, Composition, Follow, Comment
+import time
+import click
+from app import create_app, db, mail, outbox, job_runner, principal_cache, rendering, export
+from app.models import User, Role, Permission, Composition, Follow, Comment, TimelineEntry, \
+    Change, Job, reconcile_counters
 from flask_migrate import Migrate, upgrade
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
@@ -10,21 +13,110 @@ migrate = Migrate(app, db)
 def make_shell_context():
     return dict(db=db,
                 mail=mail,
+                outbox=outbox,
+                principal_cache=principal_cache,
                 User=User,
                 Role=Role,
                 Permission=Permission,
                 Composition=Composition,
                 Follow=Follow,
-                Comment=Comment,)
+                Comment=Comment,
+                TimelineEntry=TimelineEntry,
+                Change=Change,
+                Job=Job,)
+
+
+def timed(name, task):
+    """ Run task and report how long it took and how many rows it wrote """
+    start = time.perf_counter()
+    rows = task()
+    elapsed = time.perf_counter() - start
+    click.echo(f'{name:<20}{elapsed:8.2f}s' + (f'  {rows} rows' if rows is not None else ''))
+    return elapsed
 
 
 @app.cli.command()
 def deploy():
     """ Run deployment tasks """
+    # Every step is idempotent and set-based, so a deploy on an
+    # up-to-date database takes the same time however many users it has
+    total = sum(timed(name, task) for name, task in (
+        ('migrate', upgrade),
+        ('roles', Role.insert_roles),
+        ('permissions', User.sync_permissions),
+        ('self-follows', User.add_self_follows),
+    ))
+    click.echo(f'{"total":<20}{total:8.2f}s')
+
+
+@app.cli.command('rebuild-timeline')
+def rebuild_timeline():
+    """ Recompute every user's materialized timeline from follows """
+    TimelineEntry.rebuild()
+
+
+@app.cli.command('reconcile-counters')
+def reconcile():
+    """ Recount comment, composition and follow counters in bulk """
+    reconcile_counters()
+
 
-    # migrate database
-    upgrade()
+@app.cli.command()
+@click.option('--all', 'regenerate', is_flag=True,
+              help='Recompute every slug, not only missing ones.')
+def slugs(regenerate):
+    """ Give compositions their slugs with a single UPDATE """
+    click.echo(f'{Composition.fill_slugs(regenerate)} slugs written')
+
+
+@app.cli.command()
+@click.option('--chunk-size', default=1000, help='Rows per batch.')
+@click.option('--workers', default=0, help='Rendering processes, 0 renders in this one.')
+@click.option('--base-url', envvar='RAGTIME_BASE_URL',
+              help='Site root for mention links, defaults to SERVER_NAME.')
+def rerender(chunk_size, workers, base_url):
+    """ Re-render stored description and comment HTML made by an older renderer """
+    if base_url is None:
+        if not app.config.get('SERVER_NAME'):
+            raise click.UsageError('Give --base-url (or RAGTIME_BASE_URL) '
+                                   'so mention links point at the right site')
+        base_url = app.config.get('PREFERRED_URL_SCHEME', 'http') + '://' + \
+            app.config['SERVER_NAME']
+    with app.test_request_context(base_url=base_url):
+        for name, batches in (
+                ('compositions', rendering.rerender_descriptions(
+                    Composition, chunk_size=chunk_size, workers=workers)),
+                ('comments', rendering.rerender_comments(
+                    Comment, chunk_size=chunk_size, workers=workers))):
+            total = 0
+            for count in batches:
+                total += count
+                click.echo(f'{name}: {total} re-rendered')
+            click.echo(f'{name}: done, {total} re-rendered')
 
-    Role.insert_roles()
 
-    User.add_self_follows()
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(sorted(export.TABLES)), default='compositions')
+@click.option('--output', '-o', type=click.File('wb'), default='-',
+              help='File to write, defaults to stdout.')
+@click.option('--gzip', 'compress', is_flag=True, help='gzip the output.')
+@click.option('--chunk-size', default=1000, help='Rows fetched per round trip.')
+def export_table(table, output, compress, chunk_size):
+    """ Dump a whole table as NDJSON, one row per line """
+    with app.test_request_context():
+        chunks = export.ndjson(export.table_query(table), chunk_size=chunk_size)
+        if compress:
+            chunks = export.gzip(chunks)
+        for chunk in chunks:
+            output.write(chunk)
+
+
+@app.cli.command()
+@click.option('--threads', default=4, help='Jobs run at the same time.')
+@click.option('--once', is_flag=True, help='Exit when no job is due.')
+def worker(threads, once):
+    """ Run background jobs until interrupted """
+    try:
+        job_runner.run(threads, once=once)
+    except KeyboardInterrupt:
+        job_runner.stop()
@@ -1,19 +1,72 @@
 """
 USE ONLY FOR DEVELOPMENT!
+
+    python scripts/app_bringup.py
+    python scripts/app_bringup.py --bulk --users 10000 --compositions 100000 --comments 1000000
 """
 
+import argparse
 import sys
+import time
+from datetime import datetime
 from app import fake, db, create_app
-from app.models import User
+from app.models import User, Role
 from flask import Flask
 
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Create the database and fill it with fake data.')
+    parser.add_argument('--bulk', action='store_true',
+                        help='seed at load-testing scale with bulk inserts')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--compositions', type=int, default=10000)
+    parser.add_argument('--comments', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0,
+                        help='same seed, same data')
+    parser.add_argument('--epoch', type=datetime.fromisoformat, default=fake.EPOCH,
+                        help='timestamps fall in the year before this (ISO 8601)')
+    parser.add_argument('--chunk-size', type=int, default=5000,
+                        help='rows per INSERT/UPDATE batch')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='processes rendering HTML, 0 renders in this one')
+    parser.add_argument('--base-url', default='http://localhost:5000',
+                        help='site root for mention links')
+    return parser.parse_args(argv)
+
+
+def bulk_seed(app, args):
+    started = time.perf_counter()
+    last = {}
+
+    def progress(step, done):
+        # Report every step once, then about every ten chunks
+        if step not in last or done - last[step] >= args.chunk_size * 10:
+            last[step] = done
+            print(f'{time.perf_counter() - started:8.1f}s  {step}: {done}')
+
+    with app.test_request_context(base_url=args.base_url):
+        Role.insert_roles()
+        fake.create_bulk_fake_data(users=args.users,
+                                   compositions=args.compositions,
+                                   comments=args.comments,
+                                   seed=args.seed,
+                                   epoch=args.epoch,
+                                   chunk_size=args.chunk_size,
+                                   workers=args.workers,
+                                   progress=progress)
+    print(f'Seeded in {time.perf_counter() - started:.1f}s')
+
+
 if __name__ == "__main__":
     # be sure to install packages (requirements/dev.txt) and
     # set environment variables or create launch files
     # and also create migrations folder via flask db init
+    args = parse_args(sys.argv[1:])
     app: Flask = create_app('development')
     with app.app_context():
         db.create_all()
-        if User.query.count() < 20:
+        if args.bulk:
+            bulk_seed(app, args)
+        elif User.query.count() < 20:
             fake.create_fake_data()
         print(f"You can use this to login:\nEmail: {User.query.first().email}\nPassword: password")
@@ -0,0 +1,82 @@
+"""
+Basic auth API throughput, with and without the credential cache.
+
+    python scripts/bench_basic_auth.py --requests 200 --threads 4
+
+Every request authenticates with email and password against a
+throwaway SQLite database, so without the cache each one pays for a full
+PBKDF2 check.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from app import create_app, db, credential_cache
+from app.models import Role, User
+
+
+def headers(email, password):
+    credentials = b64encode(f'{email}:{password}'.encode('utf-8')).decode('utf-8')
+    return {'Authorization': 'Basic ' + credentials,
+            'Accept': 'application/json'}
+
+
+def run(app, requests, threads):
+    auth = headers('bench@example.com', 'password')
+
+    def worker(count):
+        client = app.test_client()
+        with app.app_context():
+            for _ in range(count):
+                response = client.get('/api/v1/users/1', headers=auth)
+                assert response.status_code == 200, response.status_code
+            db.session.remove()
+
+    credential_cache.cache.clear()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _ in executor.map(worker, [requests // threads] * threads):
+            pass
+    return (requests // threads * threads) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='password hashing processes (0 = request thread)')
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    os.environ['DATABASE_TEST_URL'] = 'sqlite:///' + path
+    app = create_app('testing')
+    app.config['RAGTIME_PASSWORD_HASH_WORKERS'] = args.workers
+    try:
+        with app.app_context():
+            db.create_all()
+            Role.insert_roles()
+            db.session.add(User(email='bench@example.com', username='bench',
+                                password='password', confirmed=True))
+            db.session.commit()
+
+        app.config['RAGTIME_CREDENTIAL_CACHE_TTL'] = 0
+        before = run(app, args.requests, args.threads)
+        app.config['RAGTIME_CREDENTIAL_CACHE_TTL'] = 60
+        after = run(app, args.requests, args.threads)
+
+        print(f"requests: {args.requests}, threads: {args.threads}, "
+              f"hash workers: {args.workers}")
+        print(f"without credential cache: {before:10.1f} req/s")
+        print(f"with credential cache:    {after:10.1f} req/s  ({after / before:.1f}x)")
+    finally:
+        credential_cache.shutdown()
+        os.remove(path)
@@ -0,0 +1,90 @@
+"""
+Composition list serialization throughput and peak memory.
+
+    python scripts/bench_json.py --items 10000
+
+Serializes the same in-memory compositions the way the API used to
+(url_for per URL, flask.jsonify) and through app/serialization.py with
+each available backend. Peak memory is measured with tracemalloc in a
+separate, untimed pass.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from flask import current_app, jsonify, url_for
+from app import create_app, serialization
+from app.models import Composition
+
+
+def legacy_to_json(self):
+    """What Composition.to_json used to do"""
+    return {
+        'url': url_for('api.get_composition', id=self.id),
+        'release_type': self.release_type,
+        'title': self.title,
+        'description': self.description,
+        'description_html': self.description_html,
+        'timestamp': self.timestamp,
+        'artist_url': url_for('api.get_user', id=self.artist_id),
+        'comments_url': url_for('api.get_composition_comments', id=self.id),
+        'comment_count': self.comment_count
+    }
+
+
+def legacy(compositions):
+    return jsonify({'compositions': [legacy_to_json(c) for c in compositions]})
+
+
+def fast(compositions):
+    return serialization.jsonify({'compositions': [c.to_json() for c in compositions]})
+
+
+def compositions(count):
+    start = datetime(2020, 1, 1)
+    return [Composition(id=i, release_type=i % 3, title=f'song number {i}',
+                        description=f'a rag by @user{i % 50}',
+                        timestamp=start + timedelta(minutes=i),
+                        artist_id=i % 50, comment_count=i % 7)
+            for i in range(1, count + 1)]
+
+
+def measure(serialize, items, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(serialize(items).get_data())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    serialize(items)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return len(items) / best, peak, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    with app.test_request_context():
+        items = compositions(args.items)
+        runs = [('legacy', legacy, 'stdlib')]
+        runs.append(('url templates', fast, 'stdlib'))
+        if serialization.orjson is not None:
+            runs.append(('url templates', fast, 'orjson'))
+        print(f"{args.items} compositions")
+        print(f"{'path':>14} {'backend':>8} {'items/s':>12} {'peak MiB':>9} {'bytes':>10}")
+        for name, serialize, backend in runs:
+            current_app.config['RAGTIME_JSON_BACKEND'] = backend
+            rate, peak, size = measure(serialize, items, args.repeat)
+            print(f"{name:>14} {backend:>8} {rate:>12.0f} {peak / 2**20:>9.1f} {size:>10}")
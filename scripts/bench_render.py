@@ -0,0 +1,77 @@
+"""
+Description rendering throughput in documents per second, by size.
+
+    python scripts/bench_render.py --seconds 1
+
+Compares the old pipeline (url_for and str.replace per mention) with the
+single-pass one in app/rendering.py, both uncached and with every
+document already in the render cache.
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import bleach
+from flask import url_for
+from app import create_app, rendering
+
+WORDS = ('the quick brown fox jumps over a lazy dog while www.ragtime.com '
+         'plays some ragtime on a detuned piano').split()
+
+
+def legacy_render(value):
+    """What Composition.on_changed_description used to do"""
+    matches = re.findall(r"@(\b[\w.]*\b)", value, flags=re.M | re.I)
+    for username in matches:
+        user_link = url_for('main.user', username=username, _external=True)
+        value = value.replace(f"@{username}", f'<a href="{user_link}">@{username}</a>')
+    return bleach.linkify(bleach.clean(value, tags=['a'], strip=True))
+
+
+def document(size, rng):
+    words = []
+    while sum(len(w) + 1 for w in words) < size:
+        if rng.random() < 0.05:
+            words.append(f'@user{rng.randint(0, 50)}')
+        else:
+            words.append(rng.choice(WORDS))
+    return ' '.join(words)
+
+
+def rate(render, documents, seconds):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for doc in documents:
+            render(doc)
+        count += len(documents)
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=1.0)
+    parser.add_argument('--sizes', default='100,1000,10000,100000')
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    rng = random.Random(0)
+    print(f"{'size':>8} {'legacy':>12} {'single-pass':>12} {'cached':>12}  docs/s")
+    with app.test_request_context():
+        for size in (int(s) for s in args.sizes.split(',')):
+            # fewer, but still a few, of the big ones
+            documents = [document(size, rng) for _ in range(max(2, min(20, 100000 // size)))]
+            template = rendering.mention_url_template()
+            legacy = rate(legacy_render, documents, args.seconds)
+            single = rate(lambda doc: rendering._render_description(doc, template),
+                          documents, args.seconds)
+            for doc in documents:
+                rendering.render_description(doc)
+            cached = rate(rendering.render_description, documents, args.seconds)
+            print(f"{size:>8} {legacy:>12.1f} {single:>12.1f} {cached:>12.1f}")
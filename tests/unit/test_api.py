@@ -1,8 +1,11 @@
-from flask import url_for
-from base64 import b64encode
-from app.models import Role, User, Permission, Follow, Comment, Composition
-from app import db
+from flask import url_for, current_app
+from base64 import b64encode, urlsafe_b64encode
+from app.models import Role, User, Permission, Follow, Comment, Composition, \
+    TimelineEntry, reconcile_counters
+from app import db, credential_cache
 from datetime import datetime
+from .test_principals import QueryCounter
+import gzip
 import json
 
 def get_api_headers(username, password):
@@ -74,6 +77,24 @@ class TestAPI():
         assert 'http://localhost:5000' + json_response['url'] == url
         assert json_response['description'] == 'this is my dog'
 
+        # release_type no longer lands in the title
+        response = new_app.put(
+            f'/api/v1/compositions/1',
+            headers=get_api_headers('john@example.com', 'cat'),
+            json=json.dumps({'release_type': 2, 'title': 'man'})
+        )
+        assert response.status_code == 200
+        json_response = json.loads(response.get_data(as_text=True))
+        assert (json_response['release_type'], json_response['title']) == (2, 'man')
+
+        response = new_app.put(
+            f'/api/v1/compositions/1',
+            headers=get_api_headers('john@example.com', 'cat'),
+            json=json.dumps({'title': 5})
+        )
+        assert response.status_code == 400
+        db.session.rollback()
+
 
     def test_comments(self, new_app, roles):
         u = User.query.first()
@@ -146,3 +167,266 @@ class TestAPI():
 
 
 
+    def test_cursor_pagination(self, new_app, roles):
+        u = User.query.filter_by(email='john@example.com').first()
+        for i in range(5):
+            db.session.add(Composition(description=f"number {i}",
+                                       title=f"number {i}",
+                                       release_type=0,
+                                       artist=u))
+        db.session.commit()
+        expected = [c.id for c in Composition.query.order_by(
+            Composition.timestamp.desc(), Composition.id.desc())]
+        current_app.config['RAGTIME_COMPS_PER_PAGE'] = 2
+        try:
+            seen = []
+            url = url_for('api.get_compositions', cursor='')
+            while url:
+                response = new_app.get(
+                    url,
+                    headers=get_api_headers('john@example.com', 'cat'))
+                assert response.status_code == 200
+                json_response = json.loads(response.get_data(as_text=True))
+                assert json_response['count'] is None
+                seen.extend(c['url'] for c in json_response['compositions'])
+                last = json_response
+                url = json_response['next']
+            assert seen == [f'/api/v1/compositions/{id}' for id in expected]
+
+            # and back again from the last page
+            response = new_app.get(
+                last['prev'],
+                headers=get_api_headers('john@example.com', 'cat'))
+            json_response = json.loads(response.get_data(as_text=True))
+            assert [c['url'] for c in json_response['compositions']] == seen[-4:-2]
+
+            response = new_app.get(
+                url_for('api.get_compositions', cursor='garbage'),
+                headers=get_api_headers('john@example.com', 'cat'))
+            assert response.status_code == 400
+
+            # well-formed, but not keys of the right types
+            for tampered in (['2020-01-01T00:00:00', [1]],
+                             ['2020-01-01T00:00:00', '1'],
+                             [{'a': 1}, 1],
+                             {'a': 1}):
+                cursor = urlsafe_b64encode(json.dumps(
+                    {'k': tampered, 'd': 'next'}).encode()).decode()
+                response = new_app.get(
+                    url_for('api.get_compositions', cursor=cursor),
+                    headers=get_api_headers('john@example.com', 'cat'))
+                assert response.status_code == 400
+                response = new_app.get(f'/?cursor={cursor}',
+                                       headers={'Accept': 'application/json'})
+                assert response.status_code == 400
+        finally:
+            current_app.config['RAGTIME_COMPS_PER_PAGE'] = 20
+
+    def test_credential_cache(self, new_app):
+        credential_cache.cache.clear()
+        hits = credential_cache.cache.hits
+        for _ in range(3):
+            response = new_app.get(
+                '/api/v1/users/1',
+                headers=get_api_headers('john@example.com', 'cat'))
+            assert response.status_code == 200
+        assert len(credential_cache.cache) == 1
+        assert credential_cache.cache.hits == hits + 2
+        # the lookup is by exact email, and so is the cache
+        response = new_app.get(
+            '/api/v1/users/1',
+            headers=get_api_headers('John@example.com', 'cat'))
+        assert response.status_code == 401
+
+        # a password change makes the remembered check worthless
+        u = User.query.filter_by(email='john@example.com').first()
+        u.password = 'dog'
+        db.session.commit()
+        response = new_app.get(
+            '/api/v1/users/1',
+            headers=get_api_headers('john@example.com', 'cat'))
+        assert response.status_code == 401
+        u.password = 'cat'
+        db.session.commit()
+
+    def test_etag(self, new_app):
+        headers = get_api_headers('john@example.com', 'cat')
+        url = url_for('api.get_compositions')
+        response = new_app.get(url, headers=headers)
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        db.event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = new_app.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', record)
+        assert response.status_code == 304
+        assert response.get_data() == b''
+        # Answered from the change log, the collection is never scanned
+        assert not [s for s in statements if 'FROM compositions' in s]
+        # another page is another representation
+        response = new_app.get(url_for('api.get_compositions', page=2),
+                               headers=dict(headers, **{'If-None-Match': etag}))
+        assert response.status_code == 200
+
+        # a new comment changes the composition's comment_count
+        c = Composition.query.first()
+        u = User.query.filter_by(email='john@example.com').first()
+        db.session.add(Comment(body='again', artist=u, composition=c))
+        db.session.commit()
+        response = new_app.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+        # so do writers that go around the ORM events
+        timeline = url_for('api.get_user_followed', id=u.id)
+        for url, rewrite in ((url, reconcile_counters),
+                             (timeline, TimelineEntry.rebuild)):
+            etag = new_app.get(url, headers=headers).headers['ETag']
+            rewrite()
+            response = new_app.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+            assert response.status_code == 200
+
+    def test_export(self, new_app):
+        headers = get_api_headers('john@example.com', 'cat')
+        url = url_for('api.export_table', table='compositions')
+        response = new_app.get(url, headers=headers)
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = response.get_data().splitlines()
+        expected = [c.id for c in Composition.query.order_by(Composition.id)]
+        assert [json.loads(line)['url'] for line in lines] == \
+            [f'/api/v1/compositions/{id}' for id in expected]
+
+        response = new_app.get(url, headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.get_data()).splitlines() == lines
+
+    def test_batch(self, new_app):
+        headers = get_api_headers('john@example.com', 'cat')
+        c = Composition.query.first()
+        comment_count = c.comment_count
+        response = new_app.post(url_for('api.batch'), headers=headers, data=json.dumps({
+            'compositions': [
+                {'release_type': 0, 'title': 'Maple Leaf Rag', 'description': 'one'},
+                {'release_type': 0, 'description': 'no title'},
+                {'release_type': 1, 'title': 'The Entertainer', 'description': 'two'},
+            ],
+            'comments': [
+                {'composition_id': c.id, 'body': 'bulk'},
+                {'composition_id': 12345, 'body': 'lost'},
+                'garbage',
+            ]}))
+        assert response.status_code == 200
+        results = json.loads(response.get_data(as_text=True))
+        assert [r['status'] for r in results['compositions']] == [201, 400, 201]
+        assert results['compositions'][1]['message'] == 'Composition must have a title'
+        assert [r['status'] for r in results['comments']] == [201, 404, 400]
+
+        id = int(results['compositions'][2]['url'].rsplit('/', 1)[1])
+        assert Composition.query.get(id).slug == f'{id}-the-entertainer'
+        db.session.refresh(c)
+        assert c.comment_count == comment_count + 1
+
+        # Badly typed items fail on their own, the valid ones still go in
+        response = new_app.post(url_for('api.batch'), headers=headers, data=json.dumps({
+            'compositions': [
+                {'release_type': 0, 'title': 'Solace', 'description': 'three'},
+                {'release_type': 0, 'title': 5, 'description': 'four'},
+                {'release_type': 0, 'title': 'Bethena', 'description': 7},
+                {'release_type': '0', 'title': 'Elite Syncopations', 'description': 'five'},
+            ],
+            'comments': [
+                {'composition_id': c.id, 'body': 42},
+                {'composition_id': [c.id], 'body': 'listed'},
+            ]}))
+        assert response.status_code == 200
+        results = json.loads(response.get_data(as_text=True))
+        assert [r['status'] for r in results['compositions']] == [201, 400, 400, 400]
+        assert [r['status'] for r in results['comments']] == [400, 404]
+        assert Composition.query.filter_by(title='Solace').count() == 1
+
+        response = new_app.post(url_for('api.batch'), headers=headers, data='[]')
+        assert response.status_code == 400
+
+    def test_batch_statements(self, new_app):
+        headers = get_api_headers('john@example.com', 'cat')
+        c = Composition.query.first()
+
+        def post(n):
+            db.session.remove()
+            with QueryCounter() as queries:
+                response = new_app.post(url_for('api.batch'), headers=headers, data=json.dumps({
+                    'compositions': [{'release_type': 0, 'title': f'rag {i}', 'description': 'x'}
+                                     for i in range(n)],
+                    'comments': [{'composition_id': c.id, 'body': 'y'} for _ in range(n)]}))
+            assert response.status_code == 200
+            return queries.count
+
+        # Only the INSERTs themselves grow with the batch
+        assert post(20) - post(10) == 20
+        assert Composition.query.filter_by(title='rag 19').count() == 1
+        assert Composition.query.filter_by(slug=None).count() == 0
+
+    def test_fields_and_embed(self, new_app):
+        headers = get_api_headers('john@example.com', 'cat')
+        response = new_app.get(url_for('api.get_compositions', fields='title,timestamp'),
+                               headers=headers)
+        compositions = json.loads(response.get_data(as_text=True))['compositions']
+        assert compositions
+        assert all(set(c) == {'url', 'title', 'timestamp'} for c in compositions)
+
+        response = new_app.get(url_for('api.get_comments', fields='body', embed='artist'),
+                               headers=headers)
+        assert response.status_code == 200
+        assert response.headers['ETag']
+        comments = json.loads(response.get_data(as_text=True))['comments']
+        assert comments
+        for c in comments:
+            assert set(c) == {'url', 'body', 'artist'}
+            assert c['artist']['username'] == 'john'
+        response = new_app.get(url_for('api.get_comments', fields='body', embed='artist'),
+                               headers=dict(headers, **{'If-None-Match': response.headers['ETag']}))
+        assert response.status_code == 304
+
+        response = new_app.get(url_for('api.get_comments', embed='everything'),
+                               headers=headers)
+        assert response.status_code == 400
+
+    def test_changes(self, new_app):
+        headers = get_api_headers('john@example.com', 'cat')
+        response = new_app.get(url_for('api.get_changes'), headers=headers)
+        assert response.status_code == 200
+        since = json.loads(response.get_data(as_text=True))['cursor']
+        while json.loads(response.get_data(as_text=True))['more']:
+            response = new_app.get(url_for('api.get_changes', since=since), headers=headers)
+            since = json.loads(response.get_data(as_text=True))['cursor']
+
+        u = User.query.filter_by(email='john@example.com').first()
+        c = Composition(release_type=0, title='changes', description='x', artist=u)
+        db.session.add(c)
+        db.session.commit()
+        c.title = 'changed'
+        comment = Comment(body='hi', artist=u, composition=c)
+        db.session.add(comment)
+        db.session.commit()
+        db.session.delete(comment)
+        db.session.commit()
+
+        response = new_app.get(url_for('api.get_changes', since=since), headers=headers)
+        changes = json.loads(response.get_data(as_text=True))['changes']
+        assert [(ch['type'], ch['op'], ch['key']['id']) for ch in changes] == [
+            ('composition', 'created', c.id),
+            ('comment', 'created', comment.id),
+            ('composition', 'updated', c.id),
+            ('comment', 'deleted', comment.id)]
+        assert changes[0]['url'] == f'/api/v1/compositions/{c.id}'
+        assert changes[-1]['url'] is None
+
+        response = new_app.get(url_for('api.get_changes', since='x'), headers=headers)
+        assert response.status_code == 400
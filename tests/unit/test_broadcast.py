@@ -0,0 +1,75 @@
+from flask import current_app
+from app import db, broadcaster
+from app.broadcast import Broadcaster, format_event
+from app.models import User, Composition
+
+
+class TestBroadcast():
+
+    def test_tb001_bounded_queues(self):
+        b = Broadcaster()
+        b.maxsize = 2
+        with b.subscribe(1, [10]) as fan, b.subscribe(2, [11]) as other:
+            assert b.publish(10, {'id': 1}) == 1
+            assert fan.get(timeout=0) == {'id': 1}
+            assert other.get(timeout=0) is None
+            for i in range(3):
+                b.publish(10, {'id': i})
+            assert fan.overflowed
+            b.follow(2, 10)
+            assert b.publish(10, {'id': 4}) == 2
+            b.unfollow(2, 10)
+            assert b.publish(10, {'id': 5}) == 1
+        assert b.connected == 0
+        assert b.publish(10, {'id': 6}) == 0
+        assert format_event({'id': 1}, event='composition') == \
+            'event: composition\ndata: {"id": 1}\n\n'
+
+    def test_tb002_published_on_commit(self, new_app, roles):
+        artist = User(email='scott@example.com', username='scott', password='cat')
+        fan = User(email='eubie@example.com', username='eubie', password='cat')
+        db.session.add_all([artist, fan])
+        db.session.commit()
+        with broadcaster.subscribe(fan.id, []) as subscription:
+            fan.follow(artist)
+            db.session.commit()
+
+            db.session.add(Composition(release_type=0, title='Rolled back',
+                                       description='x', artist=artist))
+            db.session.flush()
+            db.session.rollback()
+            assert subscription.get(timeout=0) is None
+
+            db.session.add(Composition(release_type=0, title='Maple Leaf Rag',
+                                       description='x', artist=artist))
+            db.session.commit()
+            event = subscription.get(timeout=0)
+            assert event['title'] == 'Maple Leaf Rag'
+            assert event['artist'] == 'scott'
+
+            fan.unfollow(artist)
+            db.session.commit()
+            db.session.add(Composition(release_type=0, title='Unheard',
+                                       description='x', artist=artist))
+            db.session.commit()
+            assert subscription.get(timeout=0) is None
+
+    def test_tb003_stream_limit(self, new_app):
+        User.query.filter_by(username='eubie').first().confirmed = True
+        db.session.commit()
+        current_app.config['WTF_CSRF_ENABLED'] = False
+        try:
+            response = new_app.post('/login', data={'email': 'eubie@example.com',
+                                                  'password': 'cat'})
+        finally:
+            current_app.config['WTF_CSRF_ENABLED'] = True
+        assert response.status_code == 302
+        maximum = current_app.config['RAGTIME_SSE_MAX_CLIENTS']
+        current_app.config['RAGTIME_SSE_MAX_CLIENTS'] = 0
+        try:
+            # Full: no stream, so no server thread held
+            response = new_app.get('/timeline/events')
+            assert response.status_code == 204
+        finally:
+            current_app.config['RAGTIME_SSE_MAX_CLIENTS'] = maximum
+        new_app.get('/logout')
@@ -0,0 +1,75 @@
+from app import db
+from app.models import User, Follow, Composition, Comment, TimelineEntry, Change, \
+    reconcile_counters
+
+
+class TestCounters():
+
+    def test_tc001_new_user(self, new_app, roles):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        # everybody follows themselves
+        assert u.follower_count == 1
+        assert u.following_count == 1
+        assert u.composition_count == 0
+
+    def test_tc002_insert_and_delete(self, new_app):
+        john = User.query.filter_by(username='john').first()
+        jane = User(email='jane@example.com', username='jane', password='cat')
+        db.session.add(jane)
+        db.session.commit()
+        jane.follow(john)
+        c = Composition(release_type=0, title='tune', description='a tune',
+                        artist=john)
+        db.session.add(c)
+        db.session.add(Comment(body='nice', artist=jane, composition=c))
+        db.session.add(Comment(body='nicer', artist=jane, composition=c))
+        db.session.commit()
+        assert john.follower_count == 2
+        assert jane.following_count == 2
+        assert john.composition_count == 1
+        assert c.comment_count == 2
+
+        db.session.delete(c.comments.first())
+        jane.unfollow(john)
+        db.session.commit()
+        assert c.comment_count == 1
+        assert john.follower_count == 1
+        assert jane.following_count == 1
+
+    def test_tc003_reconcile(self, new_app):
+        john = User.query.filter_by(username='john').first()
+        c = Composition.query.first()
+        db.session.execute(User.__table__.update().values(
+            composition_count=42, follower_count=42, following_count=42))
+        db.session.execute(Composition.__table__.update().values(comment_count=42))
+        db.session.commit()
+        reconcile_counters()
+        assert (john.composition_count, john.follower_count, john.following_count) == (1, 1, 1)
+        assert c.comment_count == 1
+
+    def test_tc004_add_self_follows(self, new_app):
+        john = User.query.filter_by(username='john').first()
+        c = Composition.query.first()
+        # As if john had signed up before users followed themselves
+        db.session.execute(Follow.__table__.delete().where(db.and_(
+            Follow.follower_id == john.id, Follow.following_id == john.id)))
+        db.session.execute(TimelineEntry.__table__.delete().where(
+            TimelineEntry.user_id == john.id))
+        db.session.commit()
+        reconcile_counters()
+        changes = Change.query.count()
+
+        assert User.add_self_follows() == 1
+        assert john.is_following(john)
+        assert (john.follower_count, john.following_count) == (1, 1)
+        assert TimelineEntry.query.filter_by(user_id=john.id, composition_id=c.id).count() == 1
+        assert Change.query.count() == changes + 1
+        assert Change.query.order_by(Change.id.desc()).first().to_json()['key'] == \
+            {'follower_id': john.id, 'following_id': john.id}
+
+        # Nothing left to do the second time
+        assert User.add_self_follows() == 0
+        reconcile_counters()
+        assert (john.follower_count, john.following_count) == (1, 1)
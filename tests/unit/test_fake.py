@@ -0,0 +1,47 @@
+from app import db, fake
+from app.models import User, Follow, Composition, Comment, TimelineEntry, \
+    Change, reconcile_counters
+
+
+def snapshot():
+    return (db.session.query(User.id, User.composition_count,
+                             User.follower_count, User.following_count)
+            .order_by(User.id).all(),
+            db.session.query(Composition.id, Composition.comment_count)
+            .order_by(Composition.id).all())
+
+
+class TestFake():
+
+    def test_tf001_bulk(self, new_app, roles):
+        fake.create_bulk_fake_data(users=20, compositions=50, comments=200,
+                                   seed=1, chunk_size=16)
+        assert User.query.count() == 20
+        assert Composition.query.count() == 50
+        assert Comment.query.count() == 200
+        assert Composition.query.filter(Composition.slug.is_(None)).count() == 0
+        assert Composition.query.filter(Composition.description_html.is_(None)).count() == 0
+        assert Comment.query.filter(Comment.body_html.is_(None)).count() == 0
+        assert Follow.query.filter(Follow.follower_id == Follow.following_id).count() == 20
+        assert TimelineEntry.query.count() == 50
+        # Bulk inserts aren't logged one by one, so collections are reset
+        assert {kind for kind, in db.session.query(Change.kind)
+                .filter_by(op='reset')} == {'composition', 'comment', 'timeline'}
+
+        # Counters were tallied while seeding, not recounted
+        counted = snapshot()
+        reconcile_counters()
+        assert snapshot() == counted
+
+    def test_tf002_deterministic(self, new_app):
+        def rows():
+            return (db.session.query(User.bio, User.last_seen).order_by(User.id).all(),
+                    db.session.query(Composition.title, Composition.timestamp)
+                    .order_by(Composition.id).all(),
+                    db.session.query(Comment.body, Comment.timestamp)
+                    .order_by(Comment.id).all())
+        first = rows()
+        fake.create_bulk_fake_data(users=20, compositions=50, comments=200,
+                                   seed=1, chunk_size=16)
+        for before, after in zip(first, rows()):
+            assert after[len(before):] == before
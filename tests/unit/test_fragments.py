@@ -0,0 +1,29 @@
+from flask import current_app
+from app import db, fragment_cache
+from app.models import User, Composition
+
+
+class TestFragments():
+
+    def test_tf001_cached_until_changed(self, new_app, roles):
+        u = User(email='john@example.com', username='john', password='cat')
+        c = Composition(release_type=0, title='first song',
+                        slug='first-song', description='hi', artist=u)
+        db.session.add_all([u, c])
+        db.session.commit()
+        fragment_cache.clear()
+
+        with current_app.test_request_context():
+            html = fragment_cache.composition(c)
+            assert 'first song' in html
+            assert fragment_cache.composition(c) is html
+
+            c.title = 'second song'
+            db.session.commit()
+            assert len(fragment_cache.cache) == 0
+            assert 'second song' in fragment_cache.composition(c)
+
+            u.username = 'johnny'
+            db.session.commit()
+            assert len(fragment_cache.cache) == 0
+            assert 'johnny' in fragment_cache.composition(c)
@@ -0,0 +1,110 @@
+import time
+from datetime import datetime, timedelta
+from flask import current_app, url_for
+from app import db, mail, outbox, job_runner
+from app.email import enqueue_signup_emails
+from app.jobs import enqueue, handler
+from app.models import User, Job
+
+calls = []
+
+
+@handler('test_record')
+def record(value):
+    calls.append(value)
+
+
+@handler('test_link')
+def link():
+    calls.append(url_for('main.home', _external=True))
+
+
+@handler('test_fail')
+def fail():
+    raise RuntimeError('nope')
+
+
+class TestJobs():
+
+    def test_tj001_priority_and_keys(self, new_app):
+        del calls[:]
+        enqueue('test_record', {'value': 'low'})
+        enqueue('test_record', {'value': 'high'}, priority=5, key='high')
+        enqueue('test_record', {'value': 'again'}, key='high')
+        enqueue('test_record', {'value': 'later'}, delay=3600)
+        db.session.commit()
+        assert Job.query.filter_by(key='high').count() == 1
+
+        assert job_runner.run_pending() == 2
+        assert calls == ['high', 'low']
+        assert job_runner.run_pending() == 0
+        assert Job.query.filter_by(status='done').count() == 2
+
+    def test_tj002_retries_then_fails(self, new_app):
+        job = enqueue('test_fail', max_attempts=2)
+        db.session.commit()
+        job_id = job.id
+        assert job_runner.run_pending() == 1
+        job = Job.query.get(job_id)
+        assert (job.status, job.attempts) == ('queued', 1)
+        assert 'RuntimeError' in job.last_error
+        assert job.run_at > datetime.utcnow()
+
+        job.run_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        assert job_runner.run_pending() == 1
+        job = Job.query.get(job_id)
+        assert (job.status, job.attempts) == ('failed', 2)
+
+    def test_tj003_signup_emails(self, new_app, roles):
+        admin = current_app.config['RAGTIME_ADMIN']
+        current_app.config['RAGTIME_ADMIN'] = 'admin@example.com'
+        u = User(email='joplin@example.com', username='joplin', password='cat')
+        db.session.add(u)
+        db.session.flush()
+        enqueue_signup_emails(u)
+        enqueue_signup_emails(u)
+        db.session.commit()
+        assert Job.query.filter_by(name='signup_email').count() == 3
+        with mail.record_messages() as sent:
+            assert job_runner.run_pending() == 3
+            # Delivered by the outbox, not by the jobs
+            outbox.join()
+        subjects = sorted(m.subject for m in sent if m.recipients == ['joplin@example.com'])
+        assert len(subjects) == 2
+        assert 'Confirm Your Account' in subjects[0]
+        assert [m.recipients for m in sent].count(['admin@example.com']) == 1
+        current_app.config['RAGTIME_ADMIN'] = admin
+
+    def test_tj004_base_url_of_request(self, new_app):
+        del calls[:]
+        with current_app.test_request_context(base_url='https://ragtime.example.com/'):
+            job = enqueue('test_link')
+        db.session.commit()
+        assert job.base_url == 'https://ragtime.example.com/'
+        # Like production, where SERVER_NAME isn't set
+        server_name = current_app.config['SERVER_NAME']
+        current_app.config['SERVER_NAME'] = None
+        try:
+            assert job_runner.run_pending() == 1
+        finally:
+            current_app.config['SERVER_NAME'] = server_name
+        assert calls == ['https://ragtime.example.com/']
+
+    def test_tj005_runner_starts_with_the_app(self, new_app):
+        del calls[:]
+        # Left over from before a restart; nothing new will wake the runner
+        enqueue('test_record', {'value': 'leftover'})
+        db.session.commit()
+        current_app.config['RAGTIME_JOB_WORKERS'] = 1
+        try:
+            new_app.get('/')
+            for _ in range(50):
+                if calls:
+                    break
+                time.sleep(0.1)
+        finally:
+            job_runner.stop()
+            job_runner._thread.join()
+            current_app.config['RAGTIME_JOB_WORKERS'] = 0
+        assert calls == ['leftover']
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+from app import db, last_seen_tracker
+from app.models import User
+
+
+class TestLastSeen():
+
+    def test_tls001_ping_is_buffered(self, new_app, roles):
+        long_ago = datetime.utcnow() - timedelta(days=1)
+        u = User(email='john@example.com', username='john', password='cat',
+                 last_seen=long_ago)
+        db.session.add(u)
+        db.session.commit()
+        u.ping()
+        assert u.last_seen > long_ago
+        assert u not in db.session.dirty
+        assert last_seen_tracker.pending == 1
+        stored = db.session.execute(
+            db.select([User.last_seen]).where(User.id == u.id)).scalar()
+        assert stored == long_ago
+
+    def test_tls002_coalesced_within_granularity(self, new_app):
+        u = User.query.first()
+        u.ping()
+        seen = u.last_seen
+        # even after the instance reloads the stale stored value
+        db.session.expire(u)
+        u.ping()
+        assert u.last_seen == seen
+        assert last_seen_tracker.pending == 1
+
+    def test_tls003_flush(self, new_app):
+        u = User.query.first()
+        u.ping()
+        seen = u.last_seen
+        assert last_seen_tracker.flush() == 1
+        assert last_seen_tracker.pending == 0
+        stored = db.session.execute(
+            db.select([User.last_seen]).where(User.id == u.id)).scalar()
+        assert stored == seen
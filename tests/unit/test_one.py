@@ -118,3 +118,23 @@ class TestUserRoles():
         assert not u.can(Permission.ADMIN)
         assert u.role.default
         assert u.role.name == 'User'
+
+    def test_tur007_perms_follow_role_changes(self):
+        Role.insert_roles()
+        u = User(username='jim', password='cat', email='jim@jimmyboy.com')
+        db.session.add(u)
+        db.session.commit()
+        assert not u.can(Permission.MODERATE)
+        u.role = Role.query.filter_by(name='Moderator').first()
+        assert u.can(Permission.MODERATE)
+        db.session.commit()
+        # editing the role reaches users that already have it
+        r = Role.query.filter_by(name='Moderator').first()
+        r.add_permission(Permission.ADMIN)
+        db.session.commit()
+        assert u.can(Permission.ADMIN)
+        Role.insert_roles()
+        assert not u.can(Permission.ADMIN)
+        db.session.execute(User.__table__.update().values(permissions=0))
+        User.sync_permissions()
+        assert u.can(Permission.MODERATE)
@@ -0,0 +1,88 @@
+import socketserver
+import threading
+from flask import current_app
+from flask_mail import Message
+from app import outbox
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Just enough of an SMTP server to count connections and messages"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, refuse_connections=0):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.refuse_connections = refuse_connections
+        self.connections = 0
+        self.messages = []
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        if server.refuse_connections:
+            server.refuse_connections -= 1
+            self.reply('421 busy, try later')
+            return
+        self.reply('220 stand-in')
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode('ascii').strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command == 'RCPT':
+                recipients.append(line)
+            if command == 'DATA':
+                self.reply('354 go ahead')
+                data = b''
+                while not data.endswith(b'\r\n.\r\n'):
+                    data += self.rfile.readline()
+                server.messages.append((recipients, data))
+                recipients = []
+            self.reply('250 ok')
+
+
+class TestOutbox():
+
+    def use(self, server):
+        state = current_app.extensions['mail']
+        state.suppress = False
+        state.server, state.port = server.server_address
+        state.use_tls = state.use_ssl = False
+        state.username = None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def message(self, to):
+        return Message(subject='hi', recipients=[to], body='hello',
+                       sender='admin@example.com')
+
+    def test_to001_batches_share_a_connection(self, new_app):
+        current_app.config['RAGTIME_MAIL_RETRY_BACKOFF'] = 0.01
+        server = SMTPStandIn(refuse_connections=1)
+        self.use(server)
+        try:
+            sent = outbox.stats()['sent']
+            outbox._deliver([self.message(f'user{i}@example.com') for i in range(3)])
+            assert len(server.messages) == 3
+            # one refused, then one for the whole batch
+            assert server.connections == 2
+            assert outbox.stats()['sent'] == sent + 3
+
+            for i in range(5):
+                assert outbox.send(self.message(f'queued{i}@example.com'))
+            outbox.join()
+            stats = outbox.stats()
+            assert len(server.messages) == 8
+            assert stats['queued'] == 0
+            assert stats['workers'] == current_app.config['RAGTIME_MAIL_WORKERS']
+        finally:
+            server.shutdown()
+            server.server_close()
+            outbox.shutdown()
+            current_app.extensions['mail'].suppress = True
@@ -0,0 +1,68 @@
+from app import db, page_cache
+from app.models import User, Composition, Comment
+from app.pages import Page
+
+
+class TestPageCache():
+
+    def test_tpc001_anonymous_pages(self, new_app, roles):
+        u = User(email='john@example.com', username='john', password='cat')
+        c = Composition(release_type=0, title='first song',
+                        slug='first-song', description='hi', artist=u)
+        db.session.add_all([u, c])
+        db.session.commit()
+        page_cache.clear()
+
+        response = new_app.get('/composition/first-song')
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        assert response.headers['Last-Modified']
+        hits = page_cache.cache.hits
+        assert new_app.get('/composition/first-song').data == response.data
+        assert page_cache.cache.hits == hits + 1
+
+        response = new_app.get('/composition/first-song',
+                               headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        # A comment lands on that composition only
+        new_app.get('/user/john')
+        db.session.add(Comment(body='nice', artist=u, composition=c))
+        db.session.commit()
+        response = new_app.get('/composition/first-song',
+                               headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert b'nice' in response.data
+        hits = page_cache.cache.hits
+        new_app.get('/user/john')
+        assert page_cache.cache.hits == hits + 1
+
+        # Renaming the artist changes both
+        u.username = 'johnny'
+        db.session.commit()
+        assert b'johnny' in new_app.get('/composition/first-song').data
+        assert new_app.get('/user/john').status_code == 404
+
+    def test_tpc002_invalidations_are_bounded(self, new_app):
+        page_cache.clear()
+        max_tags = page_cache.max_tags
+        page_cache.max_tags = 3
+        try:
+            page_cache.invalidate(('user', 1))
+            before = Page(body=b'', content_type=None, etag=None, last_modified=None,
+                          tags=frozenset([('user', 1)]), generation=page_cache._generation)
+            assert page_cache._fresh(before)
+            for id in range(100):
+                page_cache.invalidate(('composition', id))
+            assert len(page_cache._invalidated) == 3
+            # Forgotten, so possibly invalidated since
+            assert not page_cache._fresh(before)
+            after = before._replace(generation=page_cache._generation)
+            assert page_cache._fresh(after)
+
+            page_cache.clear()
+            assert len(page_cache._invalidated) == 0
+            assert not page_cache._fresh(before)
+            assert page_cache._fresh(after)
+        finally:
+            page_cache.max_tags = max_tags
@@ -0,0 +1,71 @@
+from app import db, principal_cache
+from app.models import User, Role, load_user
+
+
+class QueryCounter():
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        db.event.listen(db.engine, 'before_cursor_execute', self.callback)
+        return self
+
+    def __exit__(self, *args):
+        db.event.remove(db.engine, 'before_cursor_execute', self.callback)
+
+    def callback(self, *args):
+        self.count += 1
+
+
+class TestPrincipalCache():
+
+    def test_tpc001_load_user_cached(self, new_app, roles):
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        user_id = u.id
+        principal_cache.clear()
+        db.session.remove()
+
+        assert load_user(str(user_id)).username == 'john'
+        db.session.remove()
+        hits = principal_cache.users.hits
+        with QueryCounter() as queries:
+            u = load_user(str(user_id))
+            assert u.username == 'john'
+            assert u.confirmed
+        assert queries.count == 0
+        assert u in db.session
+        assert principal_cache.users.hits == hits + 1
+
+    def test_tpc002_update_evicts(self, new_app):
+        u = User.query.filter_by(username='john').first()
+        user_id = u.id
+        u.name = 'John'
+        db.session.commit()
+        db.session.remove()
+        assert load_user(str(user_id)).name == 'John'
+
+    def test_tpc003_role_change_evicts(self, new_app):
+        user_id = User.query.filter_by(username='john').first().id
+        db.session.remove()
+        load_user(str(user_id))
+        assert len(principal_cache.users) == 1
+        role = Role.query.filter_by(name='User').first()
+        role.name = 'Member'
+        db.session.commit()
+        assert len(principal_cache.users) == 0
+        role.name = 'User'
+        db.session.commit()
+
+    def test_tpc004_token_cached(self, new_app):
+        u = User.query.filter_by(username='john').first()
+        token = u.generate_auth_token(expiration_sec=60)
+        db.session.remove()
+        assert User.verify_auth_token(token).username == 'john'
+        db.session.remove()
+        with QueryCounter() as queries:
+            assert User.verify_auth_token(token).username == 'john'
+        assert queries.count == 0
+        assert User.verify_auth_token(token + 'x') is None
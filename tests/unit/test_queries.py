@@ -0,0 +1,45 @@
+from app import db, fragment_cache, page_cache
+from app.models import User, Composition
+from .test_principals import QueryCounter
+
+
+def count_queries(client, url):
+    # Cached pages and fragments would hide the queries we're counting
+    page_cache.clear()
+    fragment_cache.clear()
+    db.session.remove()
+    with QueryCounter() as queries:
+        response = client.get(url)
+    assert response.status_code == 200
+    return queries.count
+
+
+class TestQueries():
+
+    def add_fans(self, artist, count):
+        for _ in range(count):
+            n = User.query.count()
+            fan = User(email=f'fan{n}@example.com', username=f'fan{n}', password='cat')
+            fan.follow(artist)
+            db.session.add(fan)
+            db.session.add(Composition(release_type=0, title=f'rag {n}',
+                                       description=f'rag number {n}', artist=fan))
+        db.session.commit()
+
+    def test_tq001_constant_queries_per_page(self, new_app, roles):
+        artist = User(email='scott@example.com', username='scott', password='cat')
+        db.session.add(artist)
+        db.session.add(Composition(release_type=0, title='Maple Leaf Rag',
+                                   description='the first', artist=artist))
+        db.session.commit()
+        self.add_fans(artist, 1)
+        urls = ['/', '/user/scott', '/followers/scott']
+        before = [count_queries(new_app, url) for url in urls]
+
+        artist = User.query.filter_by(username='scott').first()
+        self.add_fans(artist, 6)
+        for i in range(5):
+            db.session.add(Composition(release_type=1, title=f'scott {i}',
+                                       description='another', artist=artist))
+        db.session.commit()
+        assert [count_queries(new_app, url) for url in urls] == before
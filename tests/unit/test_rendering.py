@@ -0,0 +1,47 @@
+from app import db, rendering
+from app.models import User, Composition, Comment
+
+
+class TestRendering():
+
+    def test_tr001_mentions(self, new_app):
+        html = rendering.render_description("jam with @eyoung and @eyoung2 today")
+        assert html == ('jam with '
+                        '<a href="http://localhost:5000/user/eyoung" rel="nofollow">@eyoung</a> and '
+                        '<a href="http://localhost:5000/user/eyoung2" rel="nofollow">@eyoung2</a> today')
+
+    def test_tr002_cleaned_and_linkified(self, new_app):
+        html = rendering.render_description("<b>see</b> www.blog.com <script>x</script>")
+        assert html == 'see <a href="http://www.blog.com" rel="nofollow">www.blog.com</a> x'
+        assert rendering.render_comment("<i>hi</i> @bob") == 'hi @bob'
+
+    def test_tr003_cached(self, new_app):
+        hits = rendering._cache.hits
+        first = rendering.render_description("same old @song")
+        assert rendering.render_description("same old @song") == first
+        assert rendering._cache.hits == hits + 1
+
+        # long texts are rendered every time, not kept
+        size = len(rendering._cache)
+        long = 'la ' * rendering.MAX_CACHED_LENGTH
+        assert rendering.render_comment(long) == rendering.render_comment(long)
+        assert len(rendering._cache) == size
+
+    def test_tr004_rerender_stale(self, new_app, roles):
+        u = User(email='john@example.com', username='john', password='cat')
+        c = Composition(release_type=0, title='t', description='hey @john', artist=u)
+        db.session.add_all([u, c, Comment(body='<b>old</b>', artist=u, composition=c)])
+        db.session.commit()
+        assert c.html_version == rendering.VERSION
+        db.session.execute(Composition.__table__.update().values(
+            description_html='stale', html_version=None))
+        db.session.execute(Comment.__table__.update().values(
+            body_html='stale', html_version=rendering.VERSION - 1))
+        db.session.commit()
+
+        assert list(rendering.rerender_descriptions(Composition, chunk_size=1)) == [1]
+        assert list(rendering.rerender_comments(Comment)) == [1]
+        assert list(rendering.rerender_comments(Comment)) == []
+        c = Composition.query.first()
+        assert c.description_html == rendering.render_description('hey @john')
+        assert Comment.query.first().body_html == 'old'
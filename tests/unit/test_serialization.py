@@ -0,0 +1,26 @@
+from datetime import datetime
+from flask import current_app, json, url_for
+from app import serialization
+
+
+class TestSerialization():
+
+    def test_ts001_backends_agree(self, new_app):
+        data = {'b': [1, 2.5, None, True], 'a': 'café',
+                'when': datetime(2020, 4, 5, 6, 7, 8)}
+        with current_app.test_request_context():
+            current_app.config['RAGTIME_JSON_BACKEND'] = 'stdlib'
+            stdlib = serialization.jsonify(data)
+            current_app.config['RAGTIME_JSON_BACKEND'] = 'auto'
+            fast = serialization.jsonify(data)
+        assert stdlib.mimetype == fast.mimetype == 'application/json'
+        assert json.loads(stdlib.get_data()) == json.loads(fast.get_data())
+        assert json.loads(fast.get_data())['when'] == 'Sun, 05 Apr 2020 06:07:08 GMT'
+        assert fast.get_data().endswith(b'\n')
+
+    def test_ts002_api_url(self, new_app):
+        with current_app.test_request_context():
+            for endpoint in ('api.get_user', 'api.get_composition_comments'):
+                assert serialization.api_url(endpoint, 42) == url_for(endpoint, id=42)
+        with current_app.test_request_context(base_url='http://localhost:5000/ragtime'):
+            assert serialization.api_url('api.get_user', 7) == '/ragtime/api/v1/users/7'
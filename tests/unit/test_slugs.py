@@ -0,0 +1,61 @@
+from app import db, models
+from app.models import User, Composition
+
+
+class TestSlugs():
+
+    def test_ts001_slug_on_insert(self, new_app, roles):
+        u = User(email='scott@example.com', username='scott', password='cat')
+        one = Composition(release_type=0, title='Maple Leaf Rag', description='a', artist=u)
+        two = Composition(release_type=0, title='Maple Leaf Rag', description='b', artist=u)
+        db.session.add_all([u, one, two])
+        db.session.commit()
+        assert one.slug == f'{one.id}-maple-leaf-rag'
+        assert two.slug == f'{two.id}-maple-leaf-rag'
+        db.session.expire_all()
+        assert one.slug == f'{one.id}-maple-leaf-rag'
+
+    def test_ts002_slug_follows_title(self, new_app):
+        c = Composition.query.first()
+        c.title = 'The Entertainer'
+        db.session.commit()
+        db.session.expire_all()
+        assert c.slug == f'{c.id}-the-entertainer'
+
+    def test_ts003_fill_slugs(self, new_app):
+        table = Composition.__table__
+        db.session.execute(table.update().values(slug=None))
+        db.session.commit()
+        assert Composition.fill_slugs() == 2
+        assert Composition.fill_slugs() == 0
+        for c in Composition.query:
+            assert c.slug == Composition.slugify(c.id, c.title)
+        assert Composition.fill_slugs(regenerate=True) == 2
+
+    def test_ts004_from_slug(self, new_app):
+        c = Composition.query.order_by(Composition.id).first()
+        assert Composition.from_slug(c.slug) is c
+        # Renamed: the old slug still finds it, by its id
+        old = c.slug
+        c.title = 'Solace'
+        db.session.commit()
+        assert Composition.from_slug(old) is c
+        assert c.slug == f'{c.id}-solace'
+        # Hand-made slugs go through the index once, then the cache
+        c.slug = 'solace'
+        db.session.commit()
+        assert Composition.from_slug('solace') is c
+        assert 'solace' in models._slug_ids
+        assert Composition.from_slug('nothing-here') is None
+        assert Composition.from_slug('99999999999-nothing') is None
+
+    def test_ts005_redirect_stale_slug(self, new_app):
+        c = Composition.query.order_by(Composition.id.desc()).first()
+        old = c.slug
+        c.title = 'Gladiolus Rag'
+        db.session.commit()
+        response = new_app.get(f'/composition/{old}?page=2')
+        assert response.status_code == 301
+        assert response.headers['Location'].endswith(f'/composition/{c.id}-gladiolus-rag?page=2')
+        assert new_app.get(f'/composition/{c.slug}').status_code == 200
+        assert new_app.get('/composition/0-missing').status_code == 404
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+from app import db
+from app.models import User, Composition, TimelineEntry
+
+
+class TestTimeline():
+
+    def test_tl001_fan_out_on_write(self, new_app, roles):
+        fan = User(email='fan@example.com', username='fan', password='cat')
+        star = User(email='star@example.com', username='star', password='cat')
+        db.session.add_all([fan, star])
+        db.session.commit()
+        fan.follow(star)
+        c = Composition(release_type=0,
+                        title='first',
+                        description='first one',
+                        artist=star)
+        db.session.add(c)
+        db.session.commit()
+        assert fan.followed_compositions.all() == [c]
+        assert star.followed_compositions.all() == [c]
+
+    def test_tl002_follow_backfills(self, new_app):
+        fan = User.query.filter_by(username='fan').first()
+        star = User.query.filter_by(username='star').first()
+        late = User(email='late@example.com', username='late', password='cat')
+        db.session.add(late)
+        db.session.commit()
+        late.follow(star)
+        db.session.commit()
+        assert [c.title for c in late.followed_compositions] == ['first']
+
+    def test_tl003_newest_first(self, new_app):
+        fan = User.query.filter_by(username='fan').first()
+        star = User.query.filter_by(username='star').first()
+        c = Composition(release_type=0,
+                        title='second',
+                        description='second one',
+                        timestamp=datetime.utcnow() + timedelta(minutes=1),
+                        artist=star)
+        db.session.add(c)
+        db.session.commit()
+        assert [c.title for c in fan.followed_compositions] == ['second', 'first']
+
+    def test_tl004_unfollow_prunes(self, new_app):
+        fan = User.query.filter_by(username='fan').first()
+        star = User.query.filter_by(username='star').first()
+        fan.unfollow(star)
+        db.session.commit()
+        assert fan.followed_compositions.count() == 0
+        assert star.followed_compositions.count() == 2
+
+    def test_tl005_rebuild(self, new_app):
+        before = sorted((e.user_id, e.composition_id)
+                        for e in TimelineEntry.query.all())
+        TimelineEntry.rebuild()
+        after = sorted((e.user_id, e.composition_id)
+                       for e in TimelineEntry.query.all())
+        assert before == after
+
+    def test_tl006_delete_with_foreign_keys(self, new_app):
+        star = User.query.filter_by(username='star').first()
+        c = Composition(release_type=0, title='doomed', description='gone soon',
+                        artist=star)
+        db.session.add(c)
+        db.session.commit()
+        id = c.id
+        assert TimelineEntry.query.filter_by(composition_id=id).count() > 0
+        # Enforced like PostgreSQL does; SQLite wants the pragma on every
+        # new connection, outside a transaction
+        def enforce(dbapi_connection, record):
+            dbapi_connection.execute('PRAGMA foreign_keys=ON')
+        db.session.remove()
+        db.event.listen(db.engine, 'connect', enforce)
+        try:
+            db.session.delete(Composition.query.get(id))
+            db.session.commit()
+        finally:
+            db.session.remove()
+            db.event.remove(db.engine, 'connect', enforce)
+        assert Composition.query.get(id) is None
+        assert TimelineEntry.query.filter_by(composition_id=id).count() == 0